@@ -1,78 +1,368 @@
-import os, shutil
+import os, sys, time, tempfile, threading
 from io import BytesIO
-from flask import Flask, render_template, request, flash, redirect, url_for, send_from_directory, send_file
-import fitz  # PyMuPDF
-from datetime import datetime
-from funcs import merge_pdfs, get_pdf_info
-from PyPDF2 import PdfReader, PdfWriter
+from flask import Flask, Blueprint, current_app, render_template, request, flash, redirect, url_for, send_from_directory, send_file, abort, Response, g, jsonify
+from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
+# funcs imports fitz (PyMuPDF) lazily through pdf_engine(), so none of these
+# modules load a PDF engine until a request actually needs one
+from funcs import merge_pdfs, get_pdf_info, open_pdf, parse_page_ranges, split_ranges, split_document, stream_zip, warm_pdf_engine, InvalidPDF, SPLIT_MODES
+from store import ResultStore, DEFAULT_MAX_MEMORY, DEFAULT_SPILL_THRESHOLD, DEFAULT_TTL
+from uploads import SpoolingRequest, spooled_source, DEFAULT_SPOOL_THRESHOLD
+from thumbs import ThumbnailCache, prerender_job, FORMATS as THUMB_FORMATS, DEFAULT_THUMB_CACHE_SIZE, DEFAULT_THUMB_DPI, MIN_THUMB_DPI, MAX_THUMB_DPI
+from metrics import REQUESTS, REQUEST_SECONDS, Gauge, PeakRSS, RequestProfiler, register, render_metrics
+from jobs import JobQueue, QueueFull, merge_job, split_job, DEFAULT_JOB_WORKERS, DEFAULT_QUEUE_DEPTH
+from search import SearchIndex, DEFAULT_MAX_DOCS as DEFAULT_SEARCH_MAX_DOCS
 
 """
 1. MERGE FILES ANS STORE IT ON VIRTUAL STORAGE
 """
 
-app = Flask(__name__)
-app.secret_key = 'your-secret-key'  # Required for flash messages
-uploads_folder = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
-app.config['UPLOAD_FOLDER'] = uploads_folder
+# Views, registered on every app built by create_app
+main = Blueprint('main', __name__)
 
-# Constants
-TEMP = BytesIO()
+# Per-app services, created by create_app and looked up on the current app
+RESULTS = LocalProxy(lambda: current_app.extensions['epdf']['results'])
+JOBS = LocalProxy(lambda: current_app.extensions['epdf']['jobs'])
+THUMBS = LocalProxy(lambda: current_app.extensions['epdf']['thumbs'])
+INDEX = LocalProxy(lambda: current_app.extensions['epdf']['index'])
 
-# Create uploads directory for viewing PDFs
-UPLOAD_PATH = app.config['UPLOAD_FOLDER']
+def load_config(app):
+    app.secret_key = 'your-secret-key'  # Required for flash messages
+    app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), 'static', 'uploads')
 
-@app.route('/')
-def index():
-    global TEMP
-    # RESTART TEMP
-    if TEMP.closed:
-        TEMP = BytesIO()  # Recreate it if it was closed
+    # Result store limits, override through the environment. Results live in
+    # the process that made them: serve the app from one process (threads are
+    # fine); a second process sharing RESULT_STORE_DIR fails its requests.
+    app.config['RESULT_STORE_MAX_MEMORY'] = int(os.environ.get('EPDF_STORE_MAX_MEMORY', DEFAULT_MAX_MEMORY))
+    app.config['RESULT_STORE_SPILL_THRESHOLD'] = int(os.environ.get('EPDF_STORE_SPILL_THRESHOLD', DEFAULT_SPILL_THRESHOLD))
+    app.config['RESULT_STORE_TTL'] = int(os.environ.get('EPDF_STORE_TTL', DEFAULT_TTL))
+    app.config['RESULT_STORE_DIR'] = os.environ.get('EPDF_STORE_DIR')
+
+    # Uploads above this size are spooled to a temp file and opened by path
+    app.config['UPLOAD_SPOOL_THRESHOLD'] = int(os.environ.get('EPDF_UPLOAD_SPOOL_THRESHOLD', DEFAULT_SPOOL_THRESHOLD))
+    # Add X-Peak-RSS / X-RSS-Growth headers to POST responses. Off by default:
+    # each sampled request runs a thread polling the process RSS.
+    app.config['REPORT_PEAK_RSS'] = os.environ.get('EPDF_REPORT_PEAK_RSS', '0') == '1'
+
+    # Write merge/split output linearized unless the request says otherwise (linearize=0/1)
+    app.config['LINEARIZE_OUTPUT'] = os.environ.get('EPDF_LINEARIZE', '0') == '1'
+
+    # Deduplicate and compress merge output unless the request says otherwise (optimize=0/1)
+    app.config['OPTIMIZE_MERGE'] = os.environ.get('EPDF_OPTIMIZE_MERGE', '1') == '1'
+
+    # Background merge/split jobs
+    app.config['JOB_WORKERS'] = int(os.environ.get('EPDF_JOB_WORKERS', DEFAULT_JOB_WORKERS))
+    app.config['JOB_QUEUE_DEPTH'] = int(os.environ.get('EPDF_JOB_QUEUE_DEPTH', DEFAULT_QUEUE_DEPTH))
+
+    # Page thumbnails: cache budget, and how many pages of each new result to
+    # render in the background right away (0 = only render on request)
+    app.config['THUMB_CACHE_SIZE'] = int(os.environ.get('EPDF_THUMB_CACHE_SIZE', DEFAULT_THUMB_CACHE_SIZE))
+    app.config['THUMB_PRERENDER_PAGES'] = int(os.environ.get('EPDF_THUMB_PRERENDER_PAGES', 0))
+
+    # Profile this fraction of requests with cProfile + tracemalloc (0 = off);
+    # reports are written to PROFILE_DIR
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('EPDF_PROFILE_SAMPLE_RATE', 0))
+    app.config['PROFILE_DIR'] = os.environ.get('EPDF_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'epdf-profiles'))
+
+    # Full-text index of read and merged documents; kept in memory only unless
+    # SEARCH_DIR is set, in which case it is persisted there and reloaded on start
+    app.config['SEARCH_DIR'] = os.environ.get('EPDF_SEARCH_DIR')
+    app.config['SEARCH_MAX_DOCS'] = int(os.environ.get('EPDF_SEARCH_MAX_DOCS', DEFAULT_SEARCH_MAX_DOCS))
+
+    # Import and warm the PDF engine in a background thread as soon as the app
+    # is created. Off by default: serverless cold starts that only render a
+    # page should not pay for it; the first PDF request then only imports it.
+    app.config['WARM_ENGINES'] = os.environ.get('EPDF_WARM_ENGINES', '0') == '1'
+
+def create_app(config=None):
+    """
+    Build the app: configuration from the environment (overridden by `config`),
+    its result store, job queue, thumbnail cache and search index, request hooks and routes
+    """
+    app = Flask(__name__)
+    load_config(app)
+    app.config.update(config or {})
+
+    # Subclass so the spool threshold is per app
+    app.request_class = type('SpoolingRequest', (SpoolingRequest,),
+                             {'spool_threshold': app.config['UPLOAD_SPOOL_THRESHOLD']})
+
+    index = SearchIndex(directory=app.config['SEARCH_DIR'], max_docs=app.config['SEARCH_MAX_DOCS'])
+    # Results of read/merge/split, one entry per job ID; expired ones leave the index too
+    results = ResultStore(
+        max_memory=app.config['RESULT_STORE_MAX_MEMORY'],
+        spill_threshold=app.config['RESULT_STORE_SPILL_THRESHOLD'],
+        ttl=app.config['RESULT_STORE_TTL'],
+        spill_dir=app.config['RESULT_STORE_DIR'],
+        on_drop=index.remove,
+    )
+    jobs = JobQueue(
+        workers=app.config['JOB_WORKERS'],
+        max_depth=app.config['JOB_QUEUE_DEPTH'],
+        ttl=app.config['RESULT_STORE_TTL'],
+    )
+    thumbs = ThumbnailCache(max_bytes=app.config['THUMB_CACHE_SIZE'])
+    app.extensions['epdf'] = {'results': results, 'jobs': jobs, 'thumbs': thumbs, 'index': index}
+
+    register(
+        Gauge('epdf_job_queue_depth', 'Jobs waiting in the queue', lambda: jobs.depth),
+        Gauge('epdf_result_store_memory_bytes', 'Bytes of results held in RAM', lambda: results.memory_used),
+        Gauge('epdf_result_store_entries', 'Results in the store', lambda: len(results)),
+        Gauge('epdf_thumbnail_cache_bytes', 'Bytes of cached thumbnails', lambda: thumbs.size),
+        Gauge('epdf_search_index_documents', 'Documents in the search index', lambda: len(index)),
+    )
+
+    app.before_request(start_rss_sampler)
+    app.before_request(start_request_metrics)
+    app.after_request(record_request_metrics)
+    app.after_request(report_peak_rss)
+    app.teardown_request(stop_profiler)
+    app.teardown_request(stop_rss_sampler)
+    app.register_blueprint(main)
+
+    if app.config['WARM_ENGINES']:
+        threading.Thread(target=warm_pdf_engine, name='epdf-warm', daemon=True).start()
+    return app
+
+def start_rss_sampler():
+    if current_app.config['REPORT_PEAK_RSS'] and request.method == 'POST':
+        g.rss = PeakRSS().start()
+
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    if request.endpoint != 'main.metrics':
+        g.profiler = RequestProfiler.maybe_start(current_app.config['PROFILE_SAMPLE_RATE'], current_app.config['PROFILE_DIR'])
+
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_SECONDS.observe(time.perf_counter() - g.pop('request_start', time.perf_counter()), endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
+def stop_profiler(exc):
+    # In teardown, which runs even when the view raised, so the profiler is always released
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        label = f'{request.method} {request.path}' + (f' ({type(exc).__name__})' if exc else '')
+        path = profiler.stop(label)
+        current_app.logger.info('profile for %s written to %s', request.path, path)
+
+def report_peak_rss(response):
+    sampler = g.pop('rss', None)
+    if sampler is not None:
+        sampler.stop()
+        response.headers['X-Peak-RSS'] = str(sampler.peak)
+        response.headers['X-RSS-Growth'] = str(sampler.peak - sampler.baseline)
+        current_app.logger.info('%s peak RSS %.1f MiB (+%.1f MiB)', request.path,
+                                sampler.peak / 2**20, (sampler.peak - sampler.baseline) / 2**20)
+    return response
+
+def stop_rss_sampler(exc):
+    # after_request is skipped when the view raises; never leave the thread polling
+    sampler = g.pop('rss', None)
+    if sampler is not None:
+        sampler.stop()
+
+def keep_upload(file, with_info=False):
+    """
+    Move an upload into the result store (linked, not copied, when it was
+    spooled to disk) and return its job ID, plus get_pdf_info when asked.
+    Uploads read for their info are added to the search index too.
+    """
+    filename = secure_filename(file.filename)
+    # Sanitising can drop the whole name ('文件.pdf' -> 'pdf'); merge_pdfs needs the suffix
+    if not filename.lower().endswith('.pdf'):
+        filename = 'upload.pdf'
+    with spooled_source(file) as source:
+        if isinstance(source, str):
+            job_id = RESULTS.put_file(source, filename=filename)
+        else:
+            job_id = RESULTS.put(source, filename=filename)
+    if not with_info:
+        return job_id
+    # Read from the stored copy, so an upload still in RAM is not copied again for fitz
+    try:
+        info = get_pdf_info(RESULTS.get(job_id).source, keep_text=True)
+    except Exception:
+        RESULTS.delete(job_id)
+        raise
+    INDEX.add(job_id, filename, info.pop('pageText'))
+    return job_id, info
+
+def wants_async():
+    return request.values.get('async') == '1'
+
+def request_flag(name, default, params=None):
+    value = (params if params is not None else request.values).get(name)
+    if value is None:
+        return default
+    return str(value).lower() in ('1', 'true')
+
+def wants_linearized(params=None):
+    return request_flag('linearize', current_app.config['LINEARIZE_OUTPUT'], params)
+
+def wants_optimized(params=None):
+    return request_flag('optimize', current_app.config['OPTIMIZE_MERGE'], params)
+
+def job_spec_error(kind, params):
+    """
+    Why a (type, params) job can't run, or None. Checked before answering 202 so
+    bad input fails the request instead of the job; every_n is normalised to an int.
+    """
+    if kind == 'merge':
+        inputs = params.get('inputs')
+        if not isinstance(inputs, list) or not all(isinstance(input_id, str) for input_id in inputs):
+            return '"inputs" must be a list of upload IDs'
+        if len(inputs) < 2:
+            return 'Merge needs at least 2 uploaded PDFs'
+    elif kind == 'split':
+        inputs = [params.get('input')]
+        if not isinstance(inputs[0], str):
+            return '"input" must be an upload ID'
+        mode = params.get('mode', 'ranges')
+        if mode not in SPLIT_MODES:
+            return f'"mode" must be one of {", ".join(SPLIT_MODES)}'
+        if mode == 'every':
+            every_n = params.get('every_n', 1)
+            try:
+                if isinstance(every_n, bool) or not isinstance(every_n, (int, str)):
+                    raise ValueError
+                params['every_n'] = int(every_n)
+            except ValueError:
+                return '"every_n" must be a whole number'
+            if params['every_n'] < 1:
+                return '"every_n" must be at least 1'
+        if mode == 'ranges':
+            page_ranges = params.get('page_ranges', '')
+            if not isinstance(page_ranges, str):
+                return '"page_ranges" must be a string like "1-3, 4-6, 7"'
+            try:
+                # Syntax only; ranges past the last page are checked by the job
+                parse_page_ranges(page_ranges, sys.maxsize)
+            except ValueError:
+                return f'Invalid page ranges "{page_ranges}", use a format like "1-3, 4-6, 7"'
     else:
-        TEMP.seek(0)
-        TEMP.truncate(0)
+        return f'Unknown job type "{kind}"'
+    for input_id in inputs:
+        result = RESULTS.get(input_id)
+        if result is None or result.parts is not None:
+            return f'Upload "{input_id}" not found or expired'
+    return None
+
+def submit_jobs(specs, consume_inputs=False):
+    """
+    Queue (type, params) jobs and answer 202 with their status, 400 for an
+    invalid spec, or 429 when the queue is full. With consume_inputs the
+    uploads named by the specs were stored just for these jobs: they are
+    deleted when the jobs end, or right away if the jobs are not queued.
+    """
+    queued = []
+    for kind, params in specs:
+        error = job_spec_error(kind, params)
+        if error:
+            response = jsonify({'error': error}), 400
+            break
+        if kind == 'merge':
+            queued.append((kind, merge_job, (RESULTS._get_current_object(), list(params['inputs']),
+                                             wants_linearized(params), wants_optimized(params),
+                                             INDEX._get_current_object(), consume_inputs)))
+        else:
+            queued.append((kind, split_job, (RESULTS._get_current_object(), params['input'], params.get('mode', 'ranges'),
+                                             params.get('page_ranges', ''), params.get('every_n', 1),
+                                             wants_linearized(params), consume_inputs)))
+    else:
+        try:
+            jobs = JOBS.submit_many(queued)
+            return jsonify({'jobs': [job_status(job) for job in jobs]}), 202
+        except QueueFull as e:
+            response = jsonify({'error': str(e)}), 429, {'Retry-After': '5'}
+    if consume_inputs:
+        for kind, params in specs:
+            for input_id in params.get('inputs') or [params.get('input')]:
+                if isinstance(input_id, str):
+                    RESULTS.delete(input_id)
+    return response
+
+def schedule_prerender(job_ids, pages=None):
+    """
+    Queue thumbnail pre-rendering for new results; skipped when the queue is busy
+    """
+    pages = current_app.config['THUMB_PRERENDER_PAGES'] if pages is None else pages
+    if pages <= 0 or not job_ids:
+        return None
+    # Worker threads run outside the app context, so they get the objects themselves
+    try:
+        return JOBS.submit('thumbs', prerender_job, THUMBS._get_current_object(),
+                           RESULTS._get_current_object(), list(job_ids), pages)
+    except QueueFull:
+        return None
+
+def job_status(job):
+    status = job.to_dict()
+    status['statusUrl'] = url_for('main.get_job', job_id=job.id)
+    if job.result:
+        if job.kind == 'merge':
+            status['resultUrl'] = url_for('main.serve_pdf', job_id=job.result['jobId'])
+        elif job.kind == 'split':
+            status['resultUrl'] = url_for('main.download_zip', job_id=job.result['jobId'])
+    return status
+
+@main.route('/metrics')
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@main.route('/')
+def index():
     return render_template('index.html')
 
-@app.route("/pdf")
-def serve_pdf():
-    TEMP.seek(0)
-    return send_file(TEMP, mimetype='pdf', as_attachment=False, download_name='result.pdf')
+@main.route("/pdf/<job_id>")
+def serve_pdf(job_id):
+    result = RESULTS.get(job_id)
+    if result is None:
+        abort(404)
+    if result.parts is not None:
+        # A split group has no PDF of its own; its parts come as a ZIP
+        return redirect(url_for('main.download_zip', job_id=job_id))
+    # conditional=True answers Range (206) and If-None-Match/If-Modified-Since (304)
+    response = send_file(result.open() if result.in_memory else result.path,
+                         mimetype=result.mimetype,
+                         as_attachment=request.args.get('download') == '1',
+                         download_name=result.filename,
+                         conditional=True,
+                         etag=result.etag,
+                         last_modified=result.created)
+    # Advertise ranges on full responses too, so viewers know they can fetch pages progressively
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
 
 
 
-@app.route('/read', methods=['GET', 'POST'])
+@main.route('/read', methods=['GET', 'POST'])
 def read_pdf():
-    global TEMP
-    TEMP = BytesIO()
-
     if request.method == 'POST':
         print('post method...')
 
         if 'file' not in request.files:
             flash('No file uploaded', 'danger')
-            return redirect(url_for('read_pdf'))
+            return redirect(url_for('main.read_pdf'))
 
         pdf_file = request.files['file']
         if not pdf_file.filename.lower().endswith('.pdf'):
             flash('Please upload a PDF file', 'danger')
-            return redirect(url_for('read_pdf'))
+            return redirect(url_for('main.read_pdf'))
 
         # try:
         # Save PDF file for viewing
         # view_filepath = os.path.join(UPLOAD_PATH, pdf_file.filename)
         # pdf_file.save(view_filepath)
         # pdf_file.save(TEMP)
-        TEMP.write(pdf_file.read())
-        TEMP.seek(0)
-
-
-        # Get PDF information
-        # info = get_pdf_info(view_filepath)
-        info = get_pdf_info(TEMP)
+        # Keep the upload as the result to view, opened in place for the info
+        job_id, info = keep_upload(pdf_file, with_info=True)
         
         return render_template('view_pdf.html', 
             filename=pdf_file.filename,
-            url=url_for('serve_pdf'),
+            job_id=job_id,
+            url=url_for('main.serve_pdf', job_id=job_id),
             num_words=info['numWords'],
             num_pages=info['numPages'],
             pdf_url=f'/static/uploads/{pdf_file.filename}'
@@ -83,52 +373,63 @@ def read_pdf():
             #     os.remove(view_filepath)
             print(e)
             flash(str(e), 'danger')
-            return redirect(url_for('read_pdf'))"""
+            return redirect(url_for('main.read_pdf'))"""
     
     else:
         return render_template('read.html')
 
 
-@app.route('/merge', methods=['GET', 'POST'])
+@main.route('/merge', methods=['GET', 'POST'])
 def merge_pdf():
-    global TEMP
-    TEMP = BytesIO()
-
     if request.method == "POST":
         if 'files[]' not in request.files:
             flash('No files uploaded', 'danger')
-            return redirect(url_for('merge_pdf'))
+            return redirect(url_for('main.merge_pdf'))
 
         files = request.files.getlist('files[]')
         if not files or len(files) < 2:
             flash('Please upload at least 2 PDF files', 'danger')
-            return redirect(url_for('merge_pdf'))
+            return redirect(url_for('main.merge_pdf'))
+        # Checked before anything is stored or queued, so an async merge can't fail on it later
+        for file in files:
+            if not file.filename.lower().endswith('.pdf'):
+                flash(f'{file.filename} is not a PDF file', 'danger')
+                return redirect(url_for('main.merge_pdf'))
+
+        if wants_async():
+            return submit_jobs([('merge', {'inputs': [keep_upload(f) for f in files],
+                                           'linearize': wants_linearized(),
+                                           'optimize': wants_optimized()})], consume_inputs=True)
 
         # try:
             # Merge PDFs and get information
-        result = merge_pdfs(files, TEMP)
-
+        with RESULTS.writer('output.pdf') as output:
+            result = merge_pdfs(files, output, linearize=wants_linearized(), optimize=wants_optimized(),
+                                keep_text=True)
+        INDEX.add(output.job_id, result['filename'], result.pop('pageText'))
         
+        schedule_prerender([output.job_id])
         return render_template('view_pdf.html',
             filename=result['filename'],
-            url=url_for('serve_pdf'),
+            job_id=output.job_id,
+            url=url_for('main.serve_pdf', job_id=output.job_id),
             num_pages=result['numPages'],
             num_words=result['numWords'],
             merged_files=result['mergedFiles'],
+            output_bytes=result['outputBytes'],
+            bytes_saved=result['bytesSaved'],
             pdf_url=f'/static/uploads/{result["filename"]}'
         )
 
         """except Exception as e:
             flash(str(e), 'danger')
-            return redirect(url_for('merge_pdf'))"""
+            return redirect(url_for('main.merge_pdf'))"""
     else:
         return render_template('merge.html')
     
 
-@app.route('/split_pdf', methods=['GET', 'POST'])
+@main.route('/split_pdf', methods=['GET', 'POST'])
 def split_pdf():
-    global TEMP
-    TEMP = BytesIO()
     if request.method == 'POST':
         if 'pdf_file' not in request.files:
             flash('No file selected', 'danger')
@@ -143,80 +444,62 @@ def split_pdf():
             flash('Please upload a PDF file', 'danger')
             return redirect(request.url)
         
+        mode = request.form.get('mode', 'ranges')
         page_ranges = request.form.get('page_ranges', '').strip()
-        if not page_ranges:
+        if mode not in SPLIT_MODES:
+            flash('Unknown split mode', 'danger')
+            return redirect(request.url)
+        if mode == 'ranges' and not page_ranges:
             flash('Please enter page ranges', 'danger')
             return redirect(request.url)
+        every_n = request.form.get('every_n', '1')
+        if mode == 'every' and not (every_n.strip().isdecimal() and int(every_n) >= 1):
+            flash('Pages per file must be a whole number of at least 1', 'danger')
+            return redirect(request.url)
         
-        # try:
-            # Save the uploaded file
+        if wants_async():
+            return submit_jobs([('split', {'input': keep_upload(file), 'mode': mode, 'page_ranges': page_ranges,
+                                           'every_n': every_n,
+                                           'linearize': wants_linearized()})], consume_inputs=True)
+
         filename = secure_filename(file.filename)
-        # filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        # file.save(filepath)
-        file.save(TEMP)
-        
-        # Process the page ranges
-        ranges = []
-        for part in page_ranges.split(','):
-            part = part.strip()
-            if '-' in part:
-                start, end = map(int, part.split('-'))
-                ranges.append((start, end))
-            else:
-                page = int(part)
-                ranges.append((page, page))
-        
-        # Split the PDF
-        # pdf = PdfReader(filepath)
-        pdf = PdfReader(TEMP)
-        
-        split_files = []
-        
-        for i, (start, end) in enumerate(ranges):
-            writer = PdfWriter()
-            for page_num in range(start - 1, min(end, len(pdf.pages))):
-                writer.add_page(pdf.pages[page_num])
-            
-            output_filename = f'split_{i + 1}_{os.path.splitext(filename)[0]}.pdf'
-            # output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
-            output_temp = TEMP
-            """
-            with open(output_path, 'wb') as output_file:
-                writer.write(output_file)"""
-            
-            # Get file metadata
-            split_files.append({
-                'filename': output_filename,
-                'pages': end - start + 1
-            })
-        
-        # Clean up the original file
-        # os.remove(filepath)
-        
-        return render_template('split_result.html', split_files=split_files)
-        """
+        basename = os.path.splitext(filename)[0] or 'document'
+        try:
+            # The source is parsed once and every range is cut from it
+            with spooled_source(file) as source, open_pdf(source, 'split.open') as pdf:
+                ranges = split_ranges(pdf.page_count, mode, page_ranges, every_n)
+                split_files = split_document(pdf, ranges, RESULTS, basename, linearize=wants_linearized())
+        except InvalidPDF:
+            flash(f'{file.filename} could not be read as a PDF file', 'danger')
+            return redirect(request.url)
         except ValueError as e:
-            flash('Invalid page range format. Please use format like "1-3, 4-6, 7"', 'danger')
+            flash(f'Invalid page range: {e}. Please use format like "1-3, 4-6, 7"', 'danger')
             return redirect(request.url)
-        except Exception as e:
-            flash(f'Error processing PDF: {str(e)}', 'danger')
-            return redirect(request.url)"""
+        
+        part_ids = [part['job_id'] for part in split_files]
+        job_id = RESULTS.put_group(part_ids, filename=f'{basename}_split.zip')
+        schedule_prerender(part_ids)
+        return render_template('split_result.html', split_files=split_files, job_id=job_id)
     
     return render_template('split.html')
 
-@app.route('/view/<filename>')
+@main.route('/view/<filename>')
 def view_pdf(filename):
-    file_path = os.path.join(UPLOAD_PATH, filename)
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
     if not os.path.exists(file_path):
         flash('File not found', 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
     
     try:
         info = get_pdf_info(file_path)
+        with open(file_path, 'rb') as f:
+            job_id = RESULTS.put(f, filename=filename)
         return render_template('split_result.html',
             original_filename=filename,
             split_files=[{
-                'filename': TEMP,
+                'job_id': job_id,
+                'filename': filename,
+                'pages': info['numPages'],
                 'num_pages': info['numPages'],
                 'num_words': info['numWords']
             }],
@@ -225,11 +508,109 @@ def view_pdf(filename):
         )
     except Exception as e:
         flash(str(e), 'danger')
-        return redirect(url_for('index'))
+        return redirect(url_for('main.index'))
+
+@main.route('/thumb/<job_id>/<int:page>')
+def thumbnail(job_id, page):
+    result = RESULTS.get(job_id)
+    if result is None or result.parts is not None:
+        abort(404)
+    fmt = request.args.get('fmt', 'png')
+    if fmt not in THUMB_FORMATS:
+        abort(400)
+    dpi = min(max(request.args.get('dpi', DEFAULT_THUMB_DPI, type=int), MIN_THUMB_DPI), MAX_THUMB_DPI)
+    try:
+        data = THUMBS.thumbnail(result, page, dpi, fmt)
+    except IndexError:
+        abort(404)
+    # A job ID always refers to the same content, so thumbnails can be cached by the browser
+    return send_file(BytesIO(data), mimetype=THUMB_FORMATS[fmt], conditional=True,
+                     etag=f'{job_id}-{page}-{dpi}-{fmt}', max_age=3600)
 
-@app.route('/download/<filename>')
+@main.route('/thumb/<job_id>/prerender', methods=['POST'])
+def prerender_thumbnails(job_id):
+    """
+    Render the first N pages (?pages=N) of a result, or of every part of a split, in the background
+    """
+    result = RESULTS.get(job_id)
+    if result is None:
+        return jsonify({'error': 'Result not found'}), 404
+    pages = request.values.get('pages', 1, type=int)
+    if pages < 1:
+        return jsonify({'error': 'pages must be at least 1'}), 400
+    job = schedule_prerender(result.parts if result.parts is not None else [job_id], pages)
+    if job is None:
+        return jsonify({'error': 'Job queue is full'}), 429, {'Retry-After': '5'}
+    return jsonify(job_status(job)), 202
+
+@main.route('/split/<job_id>.zip')
+def download_zip(job_id):
+    group = RESULTS.get(job_id)
+    parts = RESULTS.get_parts(job_id)
+    if not parts:
+        abort(404)
+    return Response(stream_zip(parts), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{group.filename}"'})
+
+@main.route('/search')
+def search():
+    """
+    Pages of read and merged documents containing every word of ?q=, best first
+    """
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'limit must be a number'}), 400
+    while True:
+        hits = INDEX.search(query, limit=limit)
+        # Documents indexed by an earlier process (SEARCH_DIR) have no result here any more
+        gone = {hit['docId'] for hit in hits if hit['docId'] not in RESULTS}
+        if not gone:
+            break
+        for doc_id in gone:
+            INDEX.remove(doc_id)
+    for hit in hits:
+        hit['url'] = url_for('main.serve_pdf', job_id=hit['docId']) + f'#page={hit["page"]}'
+    return jsonify({'query': query, 'total': len(hits), 'hits': hits})
+
+@main.route('/api/uploads', methods=['POST'])
+def api_upload():
+    files = request.files.getlist('files[]')
+    if not files:
+        return jsonify({'error': 'No files uploaded'}), 400
+    for file in files:
+        if not file.filename.lower().endswith('.pdf'):
+            return jsonify({'error': f'{file.filename} is not a PDF file'}), 400
+    return jsonify({'uploads': [{'id': keep_upload(file), 'filename': file.filename} for file in files]}), 201
+
+@main.route('/api/jobs', methods=['POST'])
+def api_submit_jobs():
+    """
+    Submit one job ({"type": "merge", "inputs": [...]}) or a batch ({"jobs": [...]})
+    using upload IDs from /api/uploads
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    specs = body.get('jobs', [body])
+    if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+        return jsonify({'error': '"jobs" must be a list of objects'}), 400
+    return submit_jobs([(spec.get('type'), spec) for spec in specs])
+
+@main.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_status(job))
+
+@main.route('/download/<filename>')
 def download_file(filename):
-    return send_from_directory(UPLOAD_PATH, filename, as_attachment=True)
+    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+
+# Module-level app for `flask run` and the serverless entry point (vercel.json)
+app = create_app()
 
 if __name__ == '__main__':
     app.run(debug=True, port=5080)
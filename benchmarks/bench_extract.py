@@ -0,0 +1,49 @@
+"""
+Serial vs process-pool page text extraction.
+
+    python benchmarks/bench_extract.py --pages 400 --workers 2 4 8
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from funcs import open_pdf, count_words_serial, count_words_parallel
+from corpus import make_document
+
+
+def best_of(repeat, func, *args):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=400)
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4, os.cpu_count() or 1])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    data = make_document(args.pages)
+    print(f'{args.pages} pages, {len(data) / 1024:.0f} KiB, {os.cpu_count()} CPUs')
+
+    with open_pdf(data) as pdf:
+        serial_time, expected = best_of(args.repeat, count_words_serial, pdf)
+    print(f'serial       {serial_time:8.3f}s')
+
+    for workers in sorted(set(args.workers)):
+        elapsed, result = best_of(args.repeat, count_words_parallel, data, args.pages, workers)
+        if result != expected:
+            sys.exit(f'workers={workers}: result differs from the serial path')
+        print(f'workers={workers:<3}  {elapsed:8.3f}s  x{serial_time / elapsed:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Cold start: import time and time to first response per route, each in a fresh process.
+
+    python benchmarks/bench_startup.py --repeat 5
+    python benchmarks/bench_startup.py --warm      # with EPDF_WARM_ENGINES=1
+
+Every sample starts a new interpreter that imports the app and answers a
+single request, as a serverless cold start does. The "pdf engine" column
+shows whether fitz had been loaded by the time the response was sent.
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from corpus import build_corpus
+
+# method, path and the corpus document to upload (None for no body)
+ROUTES = [
+    ('GET', '/', None),
+    ('GET', '/read', None),
+    ('GET', '/merge', None),
+    ('GET', '/split_pdf', None),
+    ('GET', '/metrics', None),
+    ('GET', '/search?q=lorem', None),
+    ('POST', '/read', 'text-small'),
+]
+
+# Runs in the child process; timings go back to the parent as JSON
+CHILD = """
+import sys, time, json
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import app as epdf
+imported = time.perf_counter()
+client = epdf.app.test_client()
+method, path, upload = {method!r}, {path!r}, {upload!r}
+if upload:
+    with open(upload, 'rb') as f:
+        response = client.post(path, data={{'file': (f, 'upload.pdf')}}, content_type='multipart/form-data')
+else:
+    response = client.open(path, method=method)
+done = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'response': done - imported, 'status': response.status_code,
+                  'engine': 'fitz' in sys.modules}}))
+"""
+
+
+def sample(method, path, upload, env):
+    code = CHILD.format(root=ROOT, method=method, path=path, upload=upload)
+    out = subprocess.run([sys.executable, '-c', code], env=env, cwd=ROOT,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='fresh processes per route')
+    parser.add_argument('--warm', action='store_true', help='warm the PDF engine at app creation')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    env = dict(os.environ, EPDF_WARM_ENGINES='1' if args.warm else '0',
+               EPDF_REPORT_PEAK_RSS='0')
+    corpus = build_corpus(quick=True)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f'{"route":24} {"import":>9} {"response":>9} {"total":>9}  pdf engine')
+        for method, path, name in ROUTES:
+            upload = None
+            if name:
+                upload = os.path.join(tmp, f'{name}.pdf')
+                with open(upload, 'wb') as f:
+                    f.write(corpus[name])
+            runs = [sample(method, path, upload, env) for _ in range(args.repeat)]
+            if any(run['status'] >= 400 for run in runs):
+                sys.exit(f'{method} {path} answered {runs[0]["status"]}')
+            case = f'{method} {path}'
+            results[case] = {
+                'import': statistics.median(run['import'] for run in runs),
+                'response': statistics.median(run['response'] for run in runs),
+                'engine': any(run['engine'] for run in runs),
+            }
+            r = results[case]
+            print(f'{case:24} {r["import"] * 1000:7.1f}ms {r["response"] * 1000:7.1f}ms '
+                  f'{(r["import"] + r["response"]) * 1000:7.1f}ms  {"loaded" if r["engine"] else "-"}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'warm': args.warm, 'repeat': args.repeat, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Deterministic synthetic PDFs for the benchmarks.
+
+The same spec always produces byte-identical output, so timings and output
+sizes can be compared across runs and machines.
+"""
+import random
+
+import fitz
+
+LOREM = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod '
+         'tempor incididunt ut labore et dolore magna aliqua').split()
+
+# Built-in MuPDF fonts embedded under their own names (real font programs,
+# unlike the base-14 references used by default)
+EMBEDDED_FONTS = ['tiro', 'cour', 'helv']
+
+# name: (pages, text lines per page, images per page, embed fonts)
+CORPUS = {
+    'text-small': (5, 20, 0, False),
+    'text-dense': (100, 60, 0, False),
+    'text-large': (500, 30, 0, False),
+    'images': (20, 10, 2, False),
+    'fonts': (30, 30, 0, True),
+    'mixed': (60, 30, 1, True),
+}
+
+# Documents skipped by --quick
+LARGE = {'text-large'}
+
+
+def make_document(pages, lines=45, images=0, fonts=False, seed=0):
+    """
+    Build a PDF and return its bytes
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        fontname = 'helv'
+        if fonts:
+            fontname = f'Emb{p % len(EMBEDDED_FONTS)}'
+            page.insert_font(fontname=fontname,
+                             fontbuffer=fitz.Font(EMBEDDED_FONTS[p % len(EMBEDDED_FONTS)]).buffer)
+
+        text = '\n'.join(' '.join(LOREM[(p + l + i) % len(LOREM)] for i in range(12))
+                         for l in range(lines))
+        top = 36
+        for i in range(images):
+            size = 96
+            pix = fitz.Pixmap(fitz.csRGB, size, size, rng.randbytes(size * size * 3), False)
+            rect = fitz.Rect(36 + i * 180, top, 36 + i * 180 + 160, top + 160)
+            page.insert_image(rect, pixmap=pix)
+        if images:
+            top += 180
+        page.insert_textbox(fitz.Rect(36, top, page.rect.width - 36, page.rect.height - 36),
+                            text, fontsize=9, fontname=fontname)
+
+    doc.set_metadata({})
+    data = doc.tobytes(garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+    return data
+
+
+def build_corpus(quick=False):
+    """
+    {name: pdf bytes} for every corpus entry
+    """
+    return {name: make_document(pages, lines, images, fonts, seed=i)
+            for i, (name, (pages, lines, images, fonts)) in enumerate(CORPUS.items())
+            if not (quick and name in LARGE)}
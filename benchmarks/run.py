@@ -0,0 +1,231 @@
+"""
+Benchmark merge, split and info on a synthetic corpus, directly and through the Flask app.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json --tolerance 0.25
+
+With --baseline the exit status is 1 when any case regressed past the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import platform
+import statistics
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fitz
+from werkzeug.datastructures import FileStorage
+
+from funcs import get_pdf_info, merge_pdfs, open_pdf, split_document, split_ranges
+from metrics import PeakRSS
+from store import ResultStore
+from search import SearchIndex
+from corpus import build_corpus
+
+# Differences smaller than these are noise, whatever the ratio
+MIN_WALL_DELTA = 0.005
+MIN_RSS_DELTA = 8 * 1024 * 1024
+SIZE_TOLERANCE = 0.05
+
+
+def measure(func, repeat):
+    """
+    Run func `repeat` times; return wall times, the largest RSS growth and
+    the output size reported by the last run
+    """
+    walls, rss, output = [], 0, None
+    for _ in range(repeat):
+        sampler = PeakRSS().start()
+        start = time.perf_counter()
+        output = func()
+        walls.append(time.perf_counter() - start)
+        sampler.stop()
+        rss = max(rss, sampler.peak - sampler.baseline)
+    return {
+        'wall': min(walls),
+        'wallMedian': statistics.median(walls),
+        'peakRssGrowth': rss,
+        'outputBytes': output or 0,
+    }
+
+
+def uploads(corpus, names):
+    return [FileStorage(stream=BytesIO(corpus[name]), filename=f'{name}.pdf') for name in names]
+
+
+def direct_cases(corpus, store):
+    cases = {}
+
+    for name, data in corpus.items():
+        cases[f'info/{name}'] = lambda data=data: get_pdf_info(data) and 0
+
+    def merge(names, optimize=False):
+        def run():
+            out = BytesIO()
+            merge_pdfs(uploads(corpus, names), out, optimize=optimize)
+            return out.getbuffer().nbytes
+        return run
+
+    for names in (['text-small', 'text-dense', 'text-large'], ['images', 'fonts', 'mixed']):
+        names = [name for name in names if name in corpus]
+        cases['merge/' + '+'.join(names)] = merge(names)
+    # Many inputs built from the same template (shared fonts)
+    cases['merge/fonts-x5'] = merge(['fonts'] * 5)
+    cases['merge/fonts-x5/optimized'] = merge(['fonts'] * 5, optimize=True)
+    cases['merge/images+fonts+mixed/optimized'] = merge(['images', 'fonts', 'mixed'], optimize=True)
+
+    def split(name, mode, page_ranges='', every_n=1):
+        def run():
+            with open_pdf(corpus[name]) as pdf:
+                ranges = split_ranges(pdf.page_count, mode, page_ranges, every_n)
+                parts = split_document(pdf, ranges, store, name)
+            size = sum(store.get(part['job_id']).size for part in parts)
+            for part in parts:
+                store.delete(part['job_id'])
+            return size
+        return run
+
+    big = 'text-large' if 'text-large' in corpus else 'text-dense'
+    cases[f'split/{big}/each'] = split(big, 'each')
+    cases[f'split/{big}/every-10'] = split(big, 'every', every_n=10)
+    cases['split/mixed/overlapping'] = split('mixed', 'ranges', '1-30, 20-50, 40-60')
+
+    texts = {name: get_pdf_info(data, keep_text=True)['pageText'] for name, data in corpus.items()}
+    index = SearchIndex()
+
+    def build_index():
+        for name, page_text in texts.items():
+            index.add(name, f'{name}.pdf', page_text)
+        return 0
+
+    def query():
+        for q in ('lorem', 'dolor sit amet', 'magna aliqua tempor', 'missing'):
+            index.search(q)
+        return 0
+
+    cases['search/index'] = build_index
+    cases['search/query'] = query
+    return cases
+
+
+def http_cases(corpus):
+    import app as epdf
+
+    client = epdf.app.test_client()
+
+    def post(path, data):
+        response = client.post(path, data=data, content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} answered {response.status_code}')
+        return response
+
+    def read():
+        post('/read', {'file': (BytesIO(corpus['text-dense']), 'text-dense.pdf')})
+        return 0
+
+    def merge():
+        files = [(BytesIO(corpus[name]), f'{name}.pdf') for name in ('text-small', 'images', 'fonts')]
+        html = post('/merge', {'files[]': files}).get_data(as_text=True)
+        job_id = html.split('/pdf/', 1)[1].split('"', 1)[0].split('?', 1)[0]
+        return len(client.get(f'/pdf/{job_id}').data)
+
+    def split():
+        html = post('/split_pdf', {'pdf_file': (BytesIO(corpus['mixed']), 'mixed.pdf'),
+                                   'mode': 'every', 'every_n': '5'}).get_data(as_text=True)
+        zip_url = '/split/' + html.split('/split/', 1)[1].split('"', 1)[0]
+        return len(client.get(zip_url).data)
+
+    return {'http/read': read, 'http/merge': merge, 'http/split+zip': split}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print a comparison table and return the names of regressed cases
+    """
+    regressions = []
+    print(f'\n{"case":36} {"base":>9} {"now":>9} {"change":>8}')
+    for case, now in results.items():
+        base = baseline.get(case)
+        if base is None:
+            print(f'{case:36} {"-":>9} {now["wall"]:9.3f}      new')
+            continue
+        change = now['wall'] / base['wall'] - 1 if base['wall'] else 0
+        flags = []
+        if change > tolerance and now['wall'] - base['wall'] > MIN_WALL_DELTA:
+            flags.append('time')
+        if (now['peakRssGrowth'] > base['peakRssGrowth'] * (1 + tolerance)
+                and now['peakRssGrowth'] - base['peakRssGrowth'] > MIN_RSS_DELTA):
+            flags.append('memory')
+        if now['outputBytes'] > base['outputBytes'] * (1 + SIZE_TOLERANCE):
+            flags.append('size')
+        if flags:
+            regressions.append(case)
+        print(f'{case:36} {base["wall"]:9.3f} {now["wall"]:9.3f} {change:+8.1%}  {" ".join(flags)}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help='skip the largest documents')
+    parser.add_argument('--filter', default='', help='only run cases containing this text')
+    parser.add_argument('--no-http', action='store_true', help='skip the Flask end-to-end cases')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against this results file')
+    parser.add_argument('--save-baseline', help='write results to this file to use as a baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown/memory growth ratio')
+    args = parser.parse_args()
+
+    corpus = build_corpus(quick=args.quick)
+    print('corpus: ' + ', '.join(f'{name} {len(data) / 1024:.0f} KiB' for name, data in corpus.items()))
+
+    with tempfile.TemporaryDirectory() as spill_dir:
+        store = ResultStore(spill_dir=spill_dir)
+        cases = direct_cases(corpus, store)
+        if not args.no_http:
+            cases.update(http_cases(corpus))
+
+        results = {}
+        for case, func in cases.items():
+            if args.filter not in case:
+                continue
+            results[case] = measure(func, args.repeat)
+            r = results[case]
+            print(f'{case:36} {r["wall"]:8.3f}s  median {r["wallMedian"]:8.3f}s  '
+                  f'rss +{r["peakRssGrowth"] / 2**20:6.1f} MiB  out {r["outputBytes"] / 1024:8.0f} KiB')
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'pymupdf': fitz.VersionBind,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'repeat': args.repeat,
+            'quick': args.quick,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s): {", ".join(regressions)}')
+            sys.exit(1)
+        print('\nno regressions')
+
+
+if __name__ == '__main__':
+    main()
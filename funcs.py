@@ -1,101 +1,457 @@
 import os
-import fitz
-from PyPDF2 import PdfReader, PdfWriter
+import zipfile
+import tempfile
+import threading
 from datetime import datetime
-from io import BytesIO
+from contextlib import ExitStack, contextmanager
+from uploads import spooled_source
+from metrics import span, source_size
 
-def merge_pdfs(files, temp):
+# Parallel text extraction: documents with at least PARALLEL_MIN_PAGES pages
+# are sharded across a pool of PARALLEL_WORKERS processes shared by the whole
+# process, smaller ones stay serial
+PARALLEL_WORKERS = int(os.environ.get('EPDF_PARALLEL_WORKERS', os.cpu_count() or 1))
+PARALLEL_MIN_PAGES = int(os.environ.get('EPDF_PARALLEL_MIN_PAGES', 150))
+
+# PyMuPDF, imported by pdf_engine() the first time a PDF is touched
+_fitz = None
+_fitz_lock = threading.Lock()
+
+
+def pdf_engine():
+    """
+    The fitz module. Importing it costs more than the rest of the app, so it
+    is only loaded on first use, once per process.
+    """
+    global _fitz
+    if _fitz is None:
+        with _fitz_lock:
+            if _fitz is None:
+                import fitz
+                _fitz = fitz
+    return _fitz
+
+
+def warm_pdf_engine():
     """
-    Merge multiple PDF files and return metadata
+    Import fitz and write, reopen, read and render a tiny document so MuPDF's
+    one-off setup is done before the first real request needs it. Meant for
+    a background thread (WARM_ENGINES); requests only import the module.
+    """
+    fitz = pdf_engine()
+    with fitz.open() as doc:
+        doc.new_page(width=72, height=72).insert_text((8, 36), 'warm')
+        data = doc.tobytes(garbage=4, deflate=True)
+    with fitz.open(stream=data, filetype='pdf') as doc:
+        doc[0].get_text('text')
+        doc[0].get_pixmap(dpi=12, alpha=False).tobytes('png')
+
+
+def pdf_source(source):
+    """
+    Normalise a path, bytes-like object or file object into a path or bytes
+    (fitz only opens streams given as bytes)
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, 'read'):
+        source.seek(0)
+        return source.read()
+    return source
+
+
+class InvalidPDF(ValueError):
     """
-    # try:
-    merger = PdfWriter()
+    Raised by open_pdf when the data can't be parsed as a PDF
+    """
+
+
+def open_pdf(source, phase=None):
+    """
+    Open a PDF with fitz from a path, raw bytes or a file object.
+    With `phase`, the open is recorded as a metrics span of that name.
+    Raises InvalidPDF for damaged or non-PDF data.
+    """
+    source = pdf_source(source)
+    if phase is not None:
+        with span(phase, bytes_in=source_size(source)) as s:
+            pdf = open_pdf(source)
+            s.pages = pdf.page_count
+        return pdf
+    fitz = pdf_engine()
+    try:
+        if isinstance(source, str):
+            return fitz.open(source, filetype='pdf')
+        return fitz.open(stream=source, filetype='pdf')
+    except fitz.FileDataError as e:
+        raise InvalidPDF(f'Not a readable PDF file ({e})') from None
+
+
+# Process pool shared by every parallel extraction in this process, created on first use
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+# Set once creating the pool has failed, e.g. on AWS Lambda where there is no
+# /dev/shm for its semaphores; extraction then stays serial in this process
+_pool_unavailable = False
+_POOL_ERRORS = (OSError, NotImplementedError, ImportError)
+
+
+def _parallel_pool(workers):
+    """
+    The shared extraction pool, so concurrent requests and jobs never run more
+    than `workers` extraction processes between them. Workers are started with
+    forkserver (or spawn), never forked from this multi-threaded server.
+    The pool is only rebuilt when a different size is asked for (benchmarks).
+    """
+    global _pool, _pool_size, _pool_unavailable
+    # Imported here: multiprocessing is only needed by large documents
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    with _pool_lock:
+        if _pool is None or _pool_size != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            try:
+                _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+            except _POOL_ERRORS:
+                _pool = None
+                _pool_unavailable = True
+                raise
+            _pool_size = workers
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def _extract_page(page, keep_text):
+    text = page.get_text("text")
+    return len(text.split()), (text if keep_text else None)
+
+
+def _extract_range(path, start, stop, keep_text=False):
+    # Each task opens and closes the document itself, so an idle worker never
+    # keeps a (possibly deleted) file open or its pages in memory
+    with open_pdf(path) as pdf:
+        return [_extract_page(pdf[i], keep_text) for i in range(start, stop)]
+
+
+@contextmanager
+def _source_path(source):
+    """
+    Yield a path to the document: the path itself, or a temp file holding the
+    bytes, so pool workers read it from disk (page cache) rather than each
+    getting its own pickled copy
+    """
+    if isinstance(source, str):
+        yield source
+        return
+    with tempfile.NamedTemporaryFile(prefix='epdf-extract-', suffix='.pdf') as f:
+        f.write(source)
+        f.flush()
+        yield f.name
+
+
+def extract_pages_serial(pdf, keep_text=False):
+    """
+    Words per page of an open fitz document, on the current thread.
+    Returns (page_words, page_text); page_text is None unless keep_text.
+    """
+    pages = [_extract_page(page, keep_text) for page in pdf]
+    return [words for words, _ in pages], ([text for _, text in pages] if keep_text else None)
+
+
+def extract_pages_parallel(source, page_count, workers=None, keep_text=False):
+    """
+    Words per page computed by the shared process pool (see _parallel_pool).
+    Workers open the document by path (bytes are written to a temp file
+    first) and handle contiguous page ranges; results come back in page order.
+    Where no process pool can be created the pages are read on this thread.
+    Returns (page_words, page_text) like extract_pages_serial.
+    """
+    from concurrent.futures.process import BrokenProcessPool
+
+    workers = max(1, workers or PARALLEL_WORKERS)
+    # A few shards per worker so a slow range doesn't leave the others idle
+    shard = max(1, -(-page_count // (workers * 4)))
+    ranges = [(start, min(start + shard, page_count)) for start in range(0, page_count, shard)]
+
+    try:
+        pool = _parallel_pool(workers)
+    except _POOL_ERRORS:
+        # No process pool on this platform: read the pages here instead
+        with open_pdf(source) as pdf:
+            return extract_pages_serial(pdf, keep_text)
+
+    pages = []
+    with _source_path(source) as path:
+        try:
+            for chunk in pool.map(_extract_range, [path] * len(ranges), *zip(*ranges),
+                                  [keep_text] * len(ranges)):
+                pages.extend(chunk)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory): start a fresh pool next time
+            _discard_pool(pool)
+            raise
+    return [words for words, _ in pages], ([text for _, text in pages] if keep_text else None)
+
+
+def count_words_serial(pdf):
+    return extract_pages_serial(pdf)[0]
+
+
+def count_words_parallel(source, page_count, workers=None):
+    return extract_pages_parallel(source, page_count, workers)[0]
+
+
+def document_stats(pdf, source=None, workers=None, min_pages=None, keep_text=False):
+    """
+    Count pages and words of an open fitz document in a single pass over its pages.
+    When `source` (path or bytes of the same document) is given and the document
+    is large enough, the pages are counted in parallel instead.
+    With keep_text the extracted text of each page is returned as 'pageText'.
+    """
+    workers = workers or PARALLEL_WORKERS
+    min_pages = PARALLEL_MIN_PAGES if min_pages is None else min_pages
+    if source is not None and workers > 1 and pdf.page_count >= min_pages and not _pool_unavailable:
+        page_words, page_text = extract_pages_parallel(source, pdf.page_count, workers, keep_text)
+    else:
+        page_words, page_text = extract_pages_serial(pdf, keep_text)
+    stats = {
+        'numPages': len(page_words),
+        'numWords': sum(page_words),
+        'pageWords': page_words
+    }
+    if keep_text:
+        stats['pageText'] = page_text
+    return stats
+
+
+def save_pdf(pdf, output, linearize=False, optimize=False):
+    """
+    Save a fitz document to a file object. Linearized ("fast web view") files
+    put the first page up front so viewers can show it before the rest arrives.
+    `optimize` merges identical objects by content (fonts, images and ICC
+    profiles shared by inputs made from the same template), drops unused
+    objects, deflates uncompressed streams and packs objects into object
+    streams with an xref stream.
+    """
+    options = {}
+    if optimize:
+        options.update(garbage=4, deflate=True, deflate_images=True, deflate_fonts=True)
+        # MuPDF can't write object streams into a linearized file
+        if not linearize:
+            options['use_objstms'] = 1
+    pdf.save(output, linear=linearize, **options)
+
+
+def merge_pdfs(files, temp, progress=None, linearize=False, optimize=False, keep_text=False):
+    """
+    Merge multiple PDF files and return metadata.
+    Each upload is parsed once, opened in place from its spool (path or bytes):
+    the same fitz document is used for the stats and as the source of the
+    pages copied into the merged output. `progress(pages_done, pages_total)`
+    is called after each file; `linearize` writes a fast-web-view PDF and
+    `optimize` a deduplicated, compressed one (see save_pdf). With keep_text
+    the text of every merged page is returned as 'pageText'.
+    """
+    merger = pdf_engine().open()
     total_pages = 0
     total_words = 0
+    input_bytes = 0
     filenames = []
-    temp_output = BytesIO()
+    file_stats = []
+    page_text = []
 
-    # Process each file
     for pdf_file in files:
-        temp_file = BytesIO()
         if not pdf_file.filename.lower().endswith('.pdf'):
             raise ValueError(f'{pdf_file.filename} is not a PDF file')
 
-        # temp_path = os.path.join(output_dir, pdf_file.filename)
-        # pdf_file.save(temp_path)
-        pdf_file.save(temp_file)
-        filenames.append(pdf_file.filename)
-
-        # Get page count and word count
-        with fitz.open(stream=temp_file, filetype='pdf') as pdf:
-            total_pages += pdf.page_count
-            for page in pdf:
-                total_words += len(page.get_text("text").split())
-
-        # Add to merger
-        """
-        with open(temp_file, 'rb') as pdf:
-            reader = PdfReader(pdf)
-            for page in reader.pages:
-                merger.add_page(page)"""
-        reader = PdfReader(temp_file)
-        for page in reader.pages:
-            merger.add_page(page)
+    with ExitStack() as stack:
+        # Open everything first so the page total is known before merging
+        opened = []
+        for pdf_file in files:
+            with span('merge.upload') as s:
+                source = stack.enter_context(spooled_source(pdf_file))
+                s.bytes_in = source_size(source)
+            input_bytes += s.bytes_in
+            pdf = stack.enter_context(open_pdf(source, 'merge.open'))
+            opened.append((pdf_file.filename, source, pdf))
+        pages_total = sum(pdf.page_count for _, _, pdf in opened)
 
+        # Process each file
+        for filename, source, pdf in opened:
+            filenames.append(filename)
+            with span('merge.extract', pages=pdf.page_count):
+                stats = document_stats(pdf, source, keep_text=keep_text)
+            if keep_text:
+                page_text.extend(stats.pop('pageText'))
+            with span('merge.insert', pages=pdf.page_count):
+                merger.insert_pdf(pdf)
 
+            total_pages += stats['numPages']
+            total_words += stats['numWords']
+            file_stats.append({'filename': filename, **stats})
+            if progress:
+                progress(total_pages, pages_total)
 
     # Save merged file
-    """
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    merged_filename = f'merged_{timestamp}.pdf'
-    merged_filepath = os.path.join(output_dir, merged_filename)
-    
-    
-    with open(merged_filepath, 'wb') as output:
-        merger.write(output)
-    
-
-
-    # Clean up temporary files
-    for filename in filenames:
-        temp_path = os.path.join(output_dir, filename)
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-    """
-    merger.write(temp)
+    with span('merge.write', pages=total_pages) as s:
+        start = temp.tell()
+        save_pdf(merger, temp, linearize, optimize)
+        s.bytes_out = temp.tell() - start
+    merger.close()
     temp.seek(0)
     return {
         'success': True,
         'filename': 'output.pdf',
         'numPages': total_pages,
         'numWords': total_words,
-        'mergedFiles': filenames
+        'mergedFiles': filenames,
+        'files': file_stats,
+        'inputBytes': input_bytes,
+        'outputBytes': s.bytes_out,
+        'bytesSaved': input_bytes - s.bytes_out,
+        **({'pageText': page_text} if keep_text else {})
     }
 
-    """except Exception as e:
-        # Clean up any temporary files on error
-        for filename in filenames:
-            temp_path = os.path.join(output_dir, filename)
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-        raise e"""
 
-def get_pdf_info(filepath):
+def get_pdf_info(filepath, keep_text=False):
     """
-    Get PDF file information
+    Get PDF file information: page count, word count and words per page
+    (and the text of each page with keep_text)
     """
-    try:
-        with fitz.open(stream=filepath, filetype='pdf') as pdf:
-            text = ""
-            num_pages = pdf.page_count
-            num_words = 0
-            for page in pdf:
-                text += page.get_text("text")
-                num_words += len(text.split())
-        return {
-            'success': True,
-            'numPages': num_pages,
-            'numWords': num_words
-        }
-    except Exception as e:
-        raise e
+    source = pdf_source(filepath)
+    with open_pdf(source, 'info.open') as pdf, span('info.extract', pages=pdf.page_count):
+        stats = document_stats(pdf, source, keep_text=keep_text)
+    return {
+        'success': True,
+        **stats
+    }
+
+
+def parse_page_ranges(spec, page_count):
+    """
+    Turn "1-3, 2-5, 7" into [(1, 3), (2, 5), (7, 7)].
+    Ranges may overlap; an end past the last page is clamped to it.
+    """
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = map(int, part.split('-'))
+        else:
+            start = end = int(part)
+        if start < 1 or start > end or start > page_count:
+            raise ValueError(f'Invalid page range "{part}" for a {page_count} page document')
+        ranges.append((start, min(end, page_count)))
+    if not ranges:
+        raise ValueError('No page ranges given')
+    return ranges
+
+
+def every_n_pages(page_count, n):
+    """
+    Ranges of n consecutive pages covering the whole document, e.g. n=1 for each page
+    """
+    if n < 1:
+        raise ValueError('Pages per file must be at least 1')
+    return [(start, min(start + n - 1, page_count)) for start in range(1, page_count + 1, n)]
+
+
+SPLIT_MODES = ('ranges', 'every', 'each')
+
+
+def split_ranges(page_count, mode='ranges', page_ranges='', every_n=1):
+    """
+    Page ranges for a split request: 'ranges' parses page_ranges,
+    'every' cuts every_n pages at a time and 'each' gives one page per part
+    """
+    if mode == 'each':
+        return every_n_pages(page_count, 1)
+    if mode == 'every':
+        return every_n_pages(page_count, int(every_n))
+    if mode == 'ranges':
+        return parse_page_ranges(page_ranges, page_count)
+    raise ValueError(f'Unknown split mode "{mode}"')
+
+
+def split_document(pdf, ranges, store, basename, progress=None, linearize=False):
+    """
+    Write every (start, end) range of an open fitz document to the result store.
+    The source is parsed once; each part is built from it and saved straight
+    into its own store entry. Returns one dict per part.
+    `progress(pages_done, pages_total)` is called after each part.
+    """
+    pages_total = sum(end - start + 1 for start, end in ranges)
+    pages_done = 0
+    parts = []
+    for i, (start, end) in enumerate(ranges):
+        filename = f'split_{i + 1}_{basename}.pdf'
+        with store.writer(filename) as output:
+            with pdf_engine().open() as part:
+                with span('split.insert', pages=end - start + 1):
+                    part.insert_pdf(pdf, from_page=start - 1, to_page=end - 1)
+                with span('split.write', pages=end - start + 1) as s:
+                    save_pdf(part, output, linearize)
+                    s.bytes_out = output.tell()
+        parts.append({
+            'job_id': output.job_id,
+            'filename': filename,
+            'start': start,
+            'end': end,
+            'pages': end - start + 1
+        })
+        pages_done += end - start + 1
+        if progress:
+            progress(pages_done, pages_total)
+    return parts
+
+
+class _ZipSink:
+    """
+    Write-only stream that hands back whatever zipfile wrote since the last pop()
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(results, chunk_size=256 * 1024):
+    """
+    Yield a ZIP archive of stored results piece by piece, so only one chunk
+    of one part is in memory at a time. PDFs are already compressed, so the
+    members are stored as-is.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+        for result in results:
+            info = zipfile.ZipInfo(result.filename, date_time=datetime.now().timetuple()[:6])
+            with result.open() as src, archive.open(info, 'w', force_zip64=result.size > 0x7fffffff) as dst:
+                for chunk in iter(lambda: src.read(chunk_size), b''):
+                    dst.write(chunk)
+                    yield sink.pop()
+    yield sink.pop()
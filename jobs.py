@@ -0,0 +1,166 @@
+import time
+import uuid
+import queue
+import threading
+from funcs import merge_pdfs, open_pdf, split_ranges, split_document
+
+"""
+BACKGROUND JOBS: MERGE/SPLIT RUN ON A BOUNDED POOL OF WORKER THREADS,
+CLIENTS POLL THE JOB STATUS INSTEAD OF HOLDING THE REQUEST OPEN
+"""
+
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_QUEUE_DEPTH = 32
+DEFAULT_JOB_TTL = 15 * 60
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class QueueFull(Exception):
+    """
+    Raised when a submit would take the queue past its depth limit
+    """
+
+
+class Job:
+    def __init__(self, kind, func, args):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.func = func
+        self.args = args
+        self.status = QUEUED
+        self.pages_done = 0
+        self.pages_total = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+
+    def progress(self, done, total):
+        self.pages_done = done
+        self.pages_total = total
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.kind,
+            'status': self.status,
+            'pagesDone': self.pages_done,
+            'pagesTotal': self.pages_total,
+            'result': self.result,
+            'error': self.error
+        }
+
+
+class JobQueue:
+    """
+    In-process job queue with `workers` threads and at most `max_depth`
+    jobs waiting. Finished jobs are forgotten `ttl` seconds after they end.
+    """
+    def __init__(self, workers=DEFAULT_JOB_WORKERS, max_depth=DEFAULT_QUEUE_DEPTH, ttl=DEFAULT_JOB_TTL):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.ttl = ttl
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _ensure_workers(self):
+        # Threads are started on first use so importing the app stays cheap
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'epdf-job-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status = RUNNING
+            try:
+                job.result = job.func(job, *job.args)
+                job.status = DONE
+            except Exception as e:
+                job.error = str(e)
+                job.status = FAILED
+            job.finished = time.time()
+            self._queue.task_done()
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit_many(self, specs):
+        """
+        Queue several (kind, func, args) jobs at once; none are queued if they don't all fit
+        """
+        with self._lock:
+            self._prune()
+            if self.depth + len(specs) > self.max_depth:
+                raise QueueFull(f'Job queue is full ({self.depth}/{self.max_depth} waiting)')
+            jobs = [Job(kind, func, args) for kind, func, args in specs]
+            for job in jobs:
+                self._jobs[job.id] = job
+            self._ensure_workers()
+            for job in jobs:
+                self._queue.put(job)
+        return jobs
+
+    def submit(self, kind, func, *args):
+        return self.submit_many([(kind, func, args)])[0]
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+
+def merge_job(job, store, input_ids, linearize=False, optimize=False, index=None, delete_inputs=False):
+    """
+    Merge stored uploads into a new result, added to the search `index` when given.
+    With delete_inputs the uploads are removed from the store once the job ends.
+    """
+    try:
+        inputs = [store.get(input_id) for input_id in input_ids]
+        if len(inputs) < 2 or None in inputs:
+            raise ValueError('Merge needs at least 2 uploaded PDFs that have not expired')
+        with store.writer('output.pdf') as output:
+            result = merge_pdfs(inputs, output, progress=job.progress, linearize=linearize, optimize=optimize,
+                                keep_text=index is not None)
+    finally:
+        if delete_inputs:
+            for input_id in input_ids:
+                store.delete(input_id)
+    if index is not None:
+        index.add(output.job_id, result['filename'], result.pop('pageText'))
+    result['jobId'] = output.job_id
+    return result
+
+
+def split_job(job, store, input_id, mode='ranges', page_ranges='', every_n=1, linearize=False,
+              delete_inputs=False):
+    """
+    Split a stored upload into parts grouped under a new result.
+    With delete_inputs the upload is removed from the store once the job ends.
+    """
+    try:
+        source = store.get(input_id)
+        if source is None:
+            raise ValueError('Uploaded PDF not found or expired')
+        basename = source.filename.rsplit('.', 1)[0] or 'document'
+        with open_pdf(source.source, 'split.open') as pdf:
+            ranges = split_ranges(pdf.page_count, mode, page_ranges, every_n)
+            parts = split_document(pdf, ranges, store, basename, progress=job.progress, linearize=linearize)
+    finally:
+        if delete_inputs:
+            store.delete(input_id)
+    group_id = store.put_group([part['job_id'] for part in parts], filename=f'{basename}_split.zip')
+    return {'jobId': group_id, 'parts': parts}
@@ -0,0 +1,263 @@
+import os
+import io
+import time
+import random
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import contextvars
+from contextlib import contextmanager
+
+"""
+INSTRUMENTATION: PER-PHASE SPANS (DURATION, PAGES, BYTES IN/OUT) EXPOSED IN
+PROMETHEUS TEXT FORMAT, PLUS OPTIONAL CPROFILE/TRACEMALLOC REPORTS FOR SAMPLED REQUESTS
+"""
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            series = self._values.setdefault(key, {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def collect(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                labels = dict(zip(self.labelnames, key))
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{self.name}_bucket{_format_labels({**labels, "le": bound})} {count}')
+                lines.append(f'{self.name}_bucket{_format_labels({**labels, "le": "+Inf"})} {series["count"]}')
+                lines.append(f'{self.name}_sum{_format_labels(labels)} {series["sum"]}')
+                lines.append(f'{self.name}_count{_format_labels(labels)} {series["count"]}')
+        return lines
+
+
+class Gauge:
+    """
+    Gauge whose value is read from a callback at scrape time
+    """
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def collect(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {self.func()}']
+
+
+PHASE_SECONDS = Histogram('epdf_phase_duration_seconds', 'Time spent per processing phase', ('phase',))
+PHASE_PAGES = Counter('epdf_phase_pages_total', 'Pages processed per phase', ('phase',))
+PHASE_BYTES_IN = Counter('epdf_phase_bytes_in_total', 'Bytes read per phase', ('phase',))
+PHASE_BYTES_OUT = Counter('epdf_phase_bytes_out_total', 'Bytes written per phase', ('phase',))
+PHASE_ERRORS = Counter('epdf_phase_errors_total', 'Phases that raised', ('phase',))
+REQUEST_SECONDS = Histogram('epdf_request_duration_seconds', 'Request handling time', ('endpoint',))
+REQUESTS = Counter('epdf_requests_total', 'Requests handled', ('endpoint', 'method', 'status'))
+
+REGISTRY = [PHASE_SECONDS, PHASE_PAGES, PHASE_BYTES_IN, PHASE_BYTES_OUT, PHASE_ERRORS,
+            REQUEST_SECONDS, REQUESTS]
+
+
+def register(*metrics):
+    """
+    Add metrics to the registry, replacing any registered under the same name
+    (so an app created again reports its own gauges)
+    """
+    names = {metric.name for metric in metrics}
+    REGISTRY[:] = [metric for metric in REGISTRY if metric.name not in names] + list(metrics)
+
+
+# Spans finished during the current request, for the profiling report
+_request_spans = contextvars.ContextVar('epdf_request_spans', default=None)
+
+
+class Span:
+    def __init__(self, phase, pages=0, bytes_in=0, bytes_out=0):
+        self.phase = phase
+        self.pages = pages
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+        self.duration = None
+
+
+@contextmanager
+def span(phase, pages=0, bytes_in=0, bytes_out=0):
+    """
+    Time a phase. Counts can be given up front or set on the yielded Span.
+    """
+    current = Span(phase, pages, bytes_in, bytes_out)
+    start = time.perf_counter()
+    try:
+        yield current
+    except Exception:
+        PHASE_ERRORS.inc(phase=phase)
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        PHASE_SECONDS.observe(current.duration, phase=phase)
+        if current.pages:
+            PHASE_PAGES.inc(current.pages, phase=phase)
+        if current.bytes_in:
+            PHASE_BYTES_IN.inc(current.bytes_in, phase=phase)
+        if current.bytes_out:
+            PHASE_BYTES_OUT.inc(current.bytes_out, phase=phase)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append(current)
+
+
+def source_size(source):
+    """
+    Size in bytes of a path or bytes source
+    """
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    return len(source)
+
+
+def current_rss():
+    """
+    Resident set size of this process in bytes (0 where it can't be read)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+class PeakRSS:
+    """
+    Samples the process RSS on a background thread and keeps the highest value.
+    RSS is process-wide, so with concurrent requests the peak includes their memory too.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.baseline = self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+        return self
+
+
+def render_metrics():
+    return '\n'.join(line for metric in REGISTRY for line in metric.collect()) + '\n'
+
+
+class RequestProfiler:
+    """
+    cProfile + tracemalloc for one request. Only one request is profiled at
+    a time; others that are sampled meanwhile are skipped.
+    """
+    _busy = threading.Lock()
+
+    def __init__(self, report_dir):
+        self.report_dir = report_dir
+        self.profile = None
+        self._started_tracemalloc = False
+
+    @classmethod
+    def maybe_start(cls, sample_rate, report_dir):
+        if sample_rate <= 0 or random.random() >= sample_rate:
+            return None
+        if not cls._busy.acquire(blocking=False):
+            return None
+        profiler = cls(report_dir)
+        _request_spans.set([])
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            profiler._started_tracemalloc = True
+        profiler.profile = cProfile.Profile()
+        profiler.profile.enable()
+        return profiler
+
+    def stop(self, label):
+        """
+        Stop profiling and write the report; returns its path
+        """
+        # Whatever happens below, profiling ends here and the next request can be sampled
+        try:
+            self.profile.disable()
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+            spans = _request_spans.get() or []
+            _request_spans.set(None)
+            RequestProfiler._busy.release()
+
+        report = io.StringIO()
+        report.write(f'{label}\n\n== Spans ==\n')
+        for s in spans:
+            report.write(f'{s.phase:20} {s.duration:9.4f}s  pages {s.pages:6}  '
+                         f'in {s.bytes_in:11}  out {s.bytes_out:11}\n')
+        report.write(f'\n== tracemalloc (peak {peak / 2**20:.1f} MiB, current {current / 2**20:.1f} MiB) ==\n')
+        for stat in snapshot.statistics('lineno')[:20]:
+            report.write(f'{stat}\n')
+        report.write('\n== cProfile (cumulative) ==\n')
+        pstats.Stats(self.profile, stream=report).sort_stats('cumulative').print_stats(40)
+
+        os.makedirs(self.report_dir, exist_ok=True)
+        safe_label = ''.join(c if c.isalnum() else '_' for c in label)[:60]
+        path = os.path.join(self.report_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{safe_label}.txt')
+        with open(path, 'w') as f:
+            f.write(report.getvalue())
+        return path
@@ -0,0 +1,280 @@
+import os
+import re
+import sys
+import json
+import zlib
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+
+"""
+FULL-TEXT SEARCH: INVERTED INDEX OF TERM -> (DOCUMENT, PAGE, POSITIONS), BUILT FROM
+THE TEXT ALREADY EXTRACTED FOR THE WORD COUNT, SO SEARCHES NEVER RE-RUN FITZ
+"""
+
+DEFAULT_MAX_DOCS = 5000
+SNIPPET_CHARS = 80
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    # Lowercase token by token: lowercasing the whole text first can change
+    # its length (e.g. 'İ'), and snippets find tokens by position in the original
+    return [match.group().lower() for match in TOKEN_RE.finditer(text)]
+
+
+class SearchIndex:
+    """
+    Thread-safe in-memory inverted index.
+
+    Each term maps to one flat array('I') of postings:
+        doc, page, n, position_1 .. position_n, doc, page, n, ...
+    which keeps thousands of documents compact. Page text is kept
+    zlib-compressed for snippets. Removed documents are tombstoned and
+    dropped from the postings when they make up a quarter of the index.
+
+    With `directory`, every document is also written there as its own
+    segment file and all segments are loaded back on start.
+    """
+    def __init__(self, directory=None, max_docs=DEFAULT_MAX_DOCS):
+        self.directory = directory
+        self.max_docs = max_docs
+        self._postings = {}
+        self._docs = OrderedDict()   # doc number -> {'id', 'filename', 'pages'}
+        self._numbers = {}           # doc ID -> doc number
+        self._texts = {}             # doc number -> [compressed page text]
+        self._removed = set()
+        self._next = 0
+        self._lock = threading.RLock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._numbers
+
+    def add(self, doc_id, filename, page_text):
+        """
+        Index a document given the text of each of its pages
+        """
+        segment = {
+            'id': doc_id,
+            'filename': filename,
+            'pages': len(page_text),
+            'postings': self._page_postings(page_text),
+            'texts': [zlib.compress(text.encode('utf-8')) for text in page_text],
+        }
+        with self._lock:
+            if doc_id in self._numbers:
+                self.remove(doc_id)
+            number = self._add_segment(segment)
+            if self.directory:
+                self._write_segment(number, segment)
+            while len(self._docs) > self.max_docs:
+                self.remove(self._docs[next(iter(self._docs))]['id'])
+
+    @staticmethod
+    def _page_postings(page_text):
+        # term -> array of page, n, positions... for every page it occurs on
+        postings = {}
+        for page, text in enumerate(page_text, start=1):
+            positions = {}
+            for position, term in enumerate(tokenize(text)):
+                positions.setdefault(term, []).append(position)
+            for term, found in positions.items():
+                postings.setdefault(term, array('I')).extend([page, len(found), *found])
+        return postings
+
+    def _add_segment(self, segment, number=None):
+        number = self._next if number is None else number
+        self._next = max(self._next, number + 1)
+        self._docs[number] = {'id': segment['id'], 'filename': segment['filename'], 'pages': segment['pages']}
+        self._numbers[segment['id']] = number
+        self._texts[number] = segment['texts']
+        for term, entries in segment['postings'].items():
+            postings = self._postings.setdefault(term, array('I'))
+            i = 0
+            while i < len(entries):
+                n = entries[i + 1]
+                postings.append(number)
+                postings.extend(entries[i:i + 2 + n])
+                i += 2 + n
+        return number
+
+    def remove(self, doc_id):
+        with self._lock:
+            number = self._numbers.pop(doc_id, None)
+            if number is None:
+                return
+            del self._docs[number]
+            del self._texts[number]
+            self._removed.add(number)
+            if self.directory:
+                try:
+                    os.remove(self._segment_path(number))
+                except OSError:
+                    pass
+            if len(self._removed) * 4 > len(self._docs) + len(self._removed):
+                self._compact()
+
+    def _compact(self):
+        for term in list(self._postings):
+            kept = array('I')
+            for number, page, positions in self._iter_postings(self._postings[term]):
+                if number not in self._removed:
+                    kept.extend((number, page, len(positions)))
+                    kept.extend(positions)
+            if kept:
+                self._postings[term] = kept
+            else:
+                del self._postings[term]
+        self._removed.clear()
+
+    @staticmethod
+    def _iter_postings(postings):
+        i = 0
+        while i < len(postings):
+            n = postings[i + 2]
+            yield postings[i], postings[i + 1], postings[i + 3:i + 3 + n]
+            i += 3 + n
+
+    def search(self, query, limit=20):
+        """
+        Pages containing every term of the query, best first, as dicts with
+        the doc ID, filename, page number, score and a text snippet
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            lists = [self._postings.get(term) for term in terms]
+            if not all(lists):
+                return []
+            # Walk the rarest term first, then keep only pages every other term is on.
+            # (doc number, page) -> [occurrences of all terms, first matching position]
+            order = sorted(range(len(terms)), key=lambda i: len(lists[i]))
+            matches = None
+            for i in order:
+                found = {}
+                for number, page, positions in self._iter_postings(lists[i]):
+                    key = (number, page)
+                    if number in self._removed or (matches is not None and key not in matches):
+                        continue
+                    score, first = matches[key] if matches is not None else (0, positions[0])
+                    found[key] = [score + len(positions), min(first, positions[0])]
+                matches = found
+                if not matches:
+                    return []
+
+            hits = sorted(matches.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+            results = []
+            for (number, page), (score, first) in hits:
+                doc = self._docs[number]
+                text = zlib.decompress(self._texts[number][page - 1]).decode('utf-8')
+                results.append({
+                    'docId': doc['id'],
+                    'filename': doc['filename'],
+                    'page': page,
+                    'score': score,
+                    'snippet': self._snippet(text, first),
+                })
+            return results
+
+    @staticmethod
+    def _snippet(text, position):
+        for i, match in enumerate(TOKEN_RE.finditer(text)):
+            if i == position:
+                start = max(0, match.start() - SNIPPET_CHARS)
+                end = min(len(text), match.end() + SNIPPET_CHARS)
+                snippet = ' '.join(text[start:end].split())
+                return ('...' if start else '') + snippet + ('...' if end < len(text) else '')
+        return ''
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f'{number:08d}.seg')
+
+    def _write_segment(self, number, segment):
+        path = self._segment_path(number)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(encode_segment(segment))
+        os.replace(path + '.tmp', path)
+
+    def _load(self):
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.seg'):
+                continue
+            try:
+                number = int(name[:-4])
+                with open(os.path.join(self.directory, name), 'rb') as f:
+                    segment = decode_segment(f.read())
+            except (OSError, ValueError):
+                continue
+            if segment['id'] in self._numbers:
+                self.remove(segment['id'])
+            self._add_segment(segment, number=number)
+
+
+# Segment file: MAGIC, a little-endian uint32 header length, a JSON header
+# (document fields plus the length of every postings array and page text),
+# then the postings as little-endian uint32 arrays and the zlib page texts.
+# Data only: nothing in a segment is ever executed when it is loaded.
+SEGMENT_MAGIC = b'EPDFSEG1'
+_HEADER_LENGTH = struct.Struct('<I')
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array('I', values)
+        values.byteswap()
+    return values
+
+
+def encode_segment(segment):
+    terms = list(segment['postings'].items())
+    header = json.dumps({
+        'id': segment['id'],
+        'filename': segment['filename'],
+        'pages': segment['pages'],
+        'terms': [[term, len(entries)] for term, entries in terms],
+        'texts': [len(text) for text in segment['texts']],
+    }).encode('utf-8')
+    chunks = [SEGMENT_MAGIC, _HEADER_LENGTH.pack(len(header)), header]
+    chunks.extend(_little_endian(entries).tobytes() for _, entries in terms)
+    chunks.extend(segment['texts'])
+    return b''.join(chunks)
+
+
+def decode_segment(data):
+    """
+    Parse a segment written by encode_segment; raises ValueError if it is malformed
+    """
+    if not data.startswith(SEGMENT_MAGIC):
+        raise ValueError('Not a search index segment')
+    try:
+        offset = len(SEGMENT_MAGIC)
+        (length,) = _HEADER_LENGTH.unpack_from(data, offset)
+        offset += _HEADER_LENGTH.size
+        header = json.loads(data[offset:offset + length])
+        offset += length
+        postings = {}
+        for term, count in header['terms']:
+            entries = array('I')
+            entries.frombytes(data[offset:offset + count * entries.itemsize])
+            offset += count * entries.itemsize
+            postings[str(term)] = _little_endian(entries)
+        texts = []
+        for size in header['texts']:
+            texts.append(data[offset:offset + size])
+            offset += size
+        segment = {'id': str(header['id']), 'filename': str(header['filename']),
+                   'pages': int(header['pages']), 'postings': postings, 'texts': texts}
+    except (KeyError, TypeError, struct.error) as e:
+        raise ValueError(f'Malformed search index segment: {e}') from e
+    if offset != len(data) or len(texts) != segment['pages']:
+        raise ValueError('Truncated search index segment')
+    return segment
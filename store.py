@@ -0,0 +1,411 @@
+import os
+import time
+import shutil
+import hashlib
+import uuid
+import tempfile
+import threading
+from io import BytesIO
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+"""
+RESULT STORE: KEEPS GENERATED PDFS PER JOB ID SO REQUESTS DON'T SHARE A BUFFER
+"""
+
+DEFAULT_MAX_MEMORY = 64 * 1024 * 1024      # RAM budget for all in-memory results
+DEFAULT_SPILL_THRESHOLD = 8 * 1024 * 1024  # results bigger than this go straight to disk
+DEFAULT_TTL = 15 * 60                      # seconds a result is kept after its last use
+
+
+# Spill directories locked by this process: real path -> (pid, open lock file)
+_claimed_dirs = {}
+_claim_lock = threading.Lock()
+
+
+def _lock_exclusive(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+
+def _claim_spill_dir(spill_dir):
+    """
+    Lock a spill directory for this process and delete the results other
+    processes left in it. Raises RuntimeError if another live process holds it.
+    """
+    path = os.path.realpath(spill_dir)
+    with _claim_lock:
+        claimed = _claimed_dirs.get(path)
+        if claimed is not None and claimed[0] == os.getpid():
+            return
+        lock_file = open(os.path.join(path, '.lock'), 'a')
+        try:
+            _lock_exclusive(lock_file)
+        except OSError:
+            lock_file.close()
+            raise RuntimeError(f'Result store directory {path} is in use by another process; '
+                               f'results are only served by the process that made them, '
+                               f'so run a single worker process') from None
+        # Held until the process exits
+        _claimed_dirs[path] = (os.getpid(), lock_file)
+        # No other process can be using the directory, so anything left in it is stale
+        for name in os.listdir(path):
+            if name.endswith('.bin'):
+                try:
+                    os.remove(os.path.join(path, name))
+                except OSError:
+                    pass
+
+
+def _new_digest(data=b''):
+    return hashlib.blake2b(data, digest_size=16)
+
+
+def _hash_file(f):
+    digest = _new_digest()
+    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class StoredResult:
+    """
+    A single result held by the store, either as bytes in RAM or as a file on disk
+    """
+    def __init__(self, job_id, filename, mimetype, data=None, path=None, size=0, parts=None, etag=None):
+        self.job_id = job_id
+        self.filename = filename
+        self.mimetype = mimetype
+        self.data = data
+        self.path = path
+        self.size = size
+        # Job IDs of the results this one groups together (e.g. the parts of a split)
+        self.parts = parts
+        self.created = time.time()
+        self.last_access = self.created
+        self._etag = etag
+
+    @property
+    def in_memory(self):
+        return self.data is not None
+
+    @property
+    def source(self):
+        """
+        The path or bytes of the result, for open_pdf without another copy
+        """
+        return self.data if self.in_memory else self.path
+
+    @property
+    def etag(self):
+        """
+        Strong ETag: a hash of the content. Results are hashed as they are
+        stored; only files adopted by put_file are read again, on first use.
+        """
+        if self._etag is None:
+            with self.open() as f:
+                self._etag = _hash_file(f)
+        return self._etag
+
+    def open(self):
+        """
+        Return a fresh read-only file object, so concurrent readers never share a position
+        """
+        if self.in_memory:
+            return BytesIO(self.data)
+        return open(self.path, 'rb')
+
+
+class ResultWriter:
+    """
+    File-like object results are written into. Starts in RAM and rolls over
+    to a file in the spill directory once it grows past the spill threshold.
+    The result becomes visible in the store when the writer is closed.
+    """
+    def __init__(self, store, job_id, filename, mimetype):
+        self.store = store
+        self.job_id = job_id
+        self.filename = filename
+        self.mimetype = mimetype
+        self._file = BytesIO()
+        self._path = None
+        self.closed = False
+        # Hash of everything written so far, while it is written strictly in order
+        self._digest = _new_digest()
+        self._hashed = 0
+
+    def _rollover(self):
+        path = self.store._spill_path(self.job_id)
+        disk_file = open(path, 'w+b')
+        disk_file.write(self._file.getbuffer())
+        disk_file.seek(self._file.tell())
+        self._file = disk_file
+        self._path = path
+
+    def write(self, data):
+        position = self._file.tell()
+        written = self._file.write(data)
+        if self._digest is not None:
+            if position == self._hashed:
+                self._digest.update(data)
+                self._hashed += written
+            else:
+                # Something seeked back and rewrote (e.g. a linearized save); hashed again on close
+                self._digest = None
+        if self._path is None and self._file.tell() > self.store.spill_threshold:
+            self._rollover()
+        return written
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        size = self._file.seek(0, os.SEEK_END)
+        if self._digest is not None and self._hashed == size:
+            etag = self._digest.hexdigest()
+        else:
+            self._file.seek(0)
+            etag = _hash_file(self._file)
+        if self._path is None:
+            data = self._file.getvalue()
+            self._file.close()
+            self.store._add(StoredResult(self.job_id, self.filename, self.mimetype,
+                                         data=data, size=size, etag=etag))
+        else:
+            self._file.close()
+            self.store._add(StoredResult(self.job_id, self.filename, self.mimetype,
+                                         path=self._path, size=size, etag=etag))
+
+    def discard(self):
+        """
+        Drop everything written so far without publishing a result
+        """
+        self.closed = True
+        self._file.close()
+        if self._path and os.path.exists(self._path):
+            os.remove(self._path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class ResultStore:
+    """
+    Thread-safe store of generated files keyed by job ID.
+
+    In-memory results are kept in LRU order; when their total size goes over
+    `max_memory` the least recently used ones are spilled to `spill_dir`.
+    Results that have not been touched for `ttl` seconds are removed.
+
+    Job IDs only resolve in the process that created them. On first use the
+    store locks `spill_dir` for its process and sweeps results left there by
+    processes that have exited; another process using the same directory
+    gets a RuntimeError rather than answering 404 for most results.
+
+    `on_drop(job_id)` is called for every result that leaves the store
+    (expired, deleted or replaced), e.g. to drop it from a search index.
+    """
+    def __init__(self, max_memory=DEFAULT_MAX_MEMORY, spill_threshold=DEFAULT_SPILL_THRESHOLD,
+                 ttl=DEFAULT_TTL, spill_dir=None, on_drop=None):
+        self.max_memory = max_memory
+        self.spill_threshold = spill_threshold
+        self.ttl = ttl
+        self.on_drop = on_drop
+        self.spill_dir = spill_dir or os.path.join(tempfile.gettempdir(), 'epdf-results')
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self.memory_used = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        # Claimed on first use, not here: a pre-forking server builds the app
+        # in a parent process that never serves a request
+        self._claimed_pid = None
+
+    def _claim(self):
+        if self._claimed_pid != os.getpid():
+            _claim_spill_dir(self.spill_dir)
+            self._claimed_pid = os.getpid()
+
+    @staticmethod
+    def new_job_id():
+        return uuid.uuid4().hex
+
+    def _spill_path(self, job_id):
+        self._claim()
+        return os.path.join(self.spill_dir, f'{job_id}.bin')
+
+    def writer(self, filename='result.pdf', mimetype='application/pdf', job_id=None):
+        """
+        Open a ResultWriter for a new (or given) job ID
+        """
+        return ResultWriter(self, job_id or self.new_job_id(), filename, mimetype)
+
+    def put(self, data, filename='result.pdf', mimetype='application/pdf', job_id=None):
+        """
+        Store bytes (or the rest of a readable file object) and return the job ID.
+        bytes are kept as they are; other bytes-like objects are copied once,
+        or written straight to the spill directory when they are large.
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            job_id = job_id or self.new_job_id()
+            with memoryview(data) as view:
+                size = view.nbytes
+                etag = _new_digest(view).hexdigest()
+                if size > self.spill_threshold:
+                    path = self._spill_path(job_id)
+                    with open(path, 'wb') as f:
+                        f.write(view)
+                    self._add(StoredResult(job_id, filename, mimetype, path=path, size=size, etag=etag))
+                    return job_id
+                if not isinstance(data, bytes):
+                    data = view.tobytes()
+            self._add(StoredResult(job_id, filename, mimetype, data=data, size=size, etag=etag))
+            return job_id
+
+        with self.writer(filename, mimetype, job_id) as out:
+            for chunk in iter(lambda: data.read(1024 * 1024), b''):
+                out.write(chunk)
+        return out.job_id
+
+    def put_file(self, path, filename='result.pdf', mimetype='application/pdf', job_id=None):
+        """
+        Store a file that is already on disk. Small files are read into RAM;
+        larger ones are hard-linked into the spill directory (copied if that
+        crosses filesystems) instead of being read.
+        """
+        size = os.path.getsize(path)
+        if size <= self.spill_threshold:
+            with open(path, 'rb') as f:
+                return self.put(f, filename, mimetype, job_id)
+
+        job_id = job_id or self.new_job_id()
+        spill_path = self._spill_path(job_id)
+        try:
+            os.link(path, spill_path)
+        except OSError:
+            shutil.copyfile(path, spill_path)
+        self._add(StoredResult(job_id, filename, mimetype, path=spill_path, size=size))
+        return job_id
+
+    def put_group(self, part_ids, filename='result.zip', job_id=None):
+        """
+        Register a job ID that refers to several stored results, and return it
+        """
+        job_id = job_id or self.new_job_id()
+        self._add(StoredResult(job_id, filename, 'application/zip', data=b'', parts=list(part_ids)))
+        return job_id
+
+    def get_parts(self, job_id):
+        """
+        Return the StoredResults grouped under a job ID, skipping expired ones
+        """
+        group = self.get(job_id)
+        if group is None or group.parts is None:
+            return None
+        return [part for part in map(self.get, group.parts) if part is not None]
+
+    def get(self, job_id):
+        """
+        Return the StoredResult for a job ID, or None if it is unknown or expired
+        """
+        self._claim()
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(job_id)
+            if entry is None:
+                return None
+            entry.last_access = time.time()
+            self._entries.move_to_end(job_id)
+            return entry
+
+    def delete(self, job_id):
+        with self._lock:
+            entry = self._entries.pop(job_id, None)
+            if entry is not None:
+                self._drop(entry)
+
+    def __contains__(self, job_id):
+        return self.get(job_id) is not None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add(self, entry):
+        self._claim()
+        with self._lock:
+            old = self._entries.pop(entry.job_id, None)
+            if old is not None:
+                self._drop(old)
+            self._entries[entry.job_id] = entry
+            if entry.in_memory:
+                self.memory_used += entry.size
+            self._expire()
+            self._enforce_budget()
+
+    def _drop(self, entry):
+        if self.on_drop is not None:
+            self.on_drop(entry.job_id)
+        if entry.in_memory:
+            self.memory_used -= entry.size
+            entry.data = None
+        elif entry.path and os.path.exists(entry.path):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                # A reader on Windows may still hold it open; the TTL sweep retries later
+                pass
+
+    def _spill(self, entry):
+        path = self._spill_path(entry.job_id)
+        with open(path, 'wb') as f:
+            f.write(entry.data)
+        self.memory_used -= entry.size
+        entry.path = path
+        entry.data = None
+
+    def _expire(self):
+        if not self.ttl:
+            return
+        cutoff = time.time() - self.ttl
+        # Entries are in LRU order, so the stale ones are at the front
+        while self._entries:
+            job_id, entry = next(iter(self._entries.items()))
+            if entry.last_access >= cutoff:
+                break
+            del self._entries[job_id]
+            self._drop(entry)
+
+    def _enforce_budget(self):
+        for entry in list(self._entries.values()):
+            if self.memory_used <= self.max_memory:
+                break
+            if entry.in_memory:
+                self._spill(entry)
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                self._drop(entry)
+            self._entries.clear()
+            self.memory_used = 0
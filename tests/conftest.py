@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# The app modules live at the repository root, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_pdf():
+    """
+    Build a PDF from the words of each page: make_pdf([['a', 'b'], ['c']])
+    """
+    from funcs import pdf_engine
+
+    def make(pages):
+        with pdf_engine().open() as doc:
+            for words in pages:
+                doc.new_page().insert_text((72, 72), '\n'.join(words))
+            return doc.tobytes()
+    return make
+
+
+@pytest.fixture
+def app(tmp_path):
+    from app import create_app
+    return create_app({'TESTING': True, 'RESULT_STORE_DIR': str(tmp_path / 'results')})
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
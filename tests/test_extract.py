@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+import funcs
+from funcs import document_stats, extract_pages_parallel, open_pdf
+
+
+@pytest.fixture
+def document(make_pdf):
+    return make_pdf([[f'p{page}w{i}' for i in range(page % 5)] for page in range(24)])
+
+
+def open_files(pid):
+    fd_dir = f'/proc/{pid}/fd'
+    files = []
+    for fd in os.listdir(fd_dir):
+        try:
+            files.append(os.readlink(os.path.join(fd_dir, fd)))
+        except OSError:
+            pass
+    return files
+
+
+def test_parallel_matches_serial(document):
+    with open_pdf(document) as pdf:
+        serial = document_stats(pdf, keep_text=True)
+        parallel = document_stats(pdf, document, workers=2, min_pages=1, keep_text=True)
+    assert parallel == serial
+    assert parallel['pageWords'] == [page % 5 for page in range(24)]
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='needs /proc')
+def test_workers_release_documents(document, tmp_path):
+    path = tmp_path / 'doc.pdf'
+    path.write_bytes(document)
+    extract_pages_parallel(str(path), 24, workers=2)
+    extract_pages_parallel(document, 24, workers=2)
+
+    pool = funcs._parallel_pool(2)
+    assert pool._processes
+    for pid in pool._processes:
+        held = open_files(pid)
+        assert str(path) not in held
+        assert not any('epdf-extract-' in name for name in held)
+
+
+def test_falls_back_to_serial_without_a_pool(document, monkeypatch):
+    def no_semaphores(*args, **kwargs):
+        raise OSError(38, 'Function not implemented')
+
+    monkeypatch.setattr('concurrent.futures.ProcessPoolExecutor', no_semaphores)
+    monkeypatch.setattr(funcs, '_pool', None)
+    monkeypatch.setattr(funcs, '_pool_unavailable', False)
+
+    with open_pdf(document) as pdf:
+        expected = document_stats(pdf)
+        assert document_stats(pdf, document, workers=2, min_pages=1) == expected
+        assert funcs._pool_unavailable
+        # Later documents skip the pool without trying again
+        monkeypatch.setattr(funcs, '_parallel_pool', None)
+        assert document_stats(pdf, document, workers=2, min_pages=1) == expected
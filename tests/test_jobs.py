@@ -0,0 +1,118 @@
+import time
+from io import BytesIO
+
+import pytest
+
+from app import create_app
+
+
+def upload(data, filename):
+    return (BytesIO(data), filename)
+
+
+def wait(client, status_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(status_url).get_json()
+        if status['status'] in ('done', 'failed'):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f'{status_url} still {status["status"]}')
+
+
+@pytest.fixture
+def pdfs(make_pdf):
+    return [make_pdf([['first', 'document']]), make_pdf([['second'], ['document']])]
+
+
+def test_upload_then_merge_job(client, app, pdfs):
+    response = client.post('/api/uploads', data={'files[]': [upload(pdfs[0], '文件.pdf'), upload(pdfs[1], 'b.pdf')]},
+                           content_type='multipart/form-data')
+    assert response.status_code == 201
+    inputs = [u['id'] for u in response.get_json()['uploads']]
+
+    response = client.post('/api/jobs', json={'type': 'merge', 'inputs': inputs})
+    assert response.status_code == 202
+    status = wait(client, response.get_json()['jobs'][0]['statusUrl'])
+    assert status['status'] == 'done', status['error']
+    assert status['result']['numPages'] == 3
+    assert status['result']['numWords'] == 4
+
+    pdf = client.get(status['resultUrl'])
+    assert pdf.status_code == 200
+    assert pdf.data.startswith(b'%PDF')
+    # Uploads from /api/uploads stay usable for more jobs
+    assert all(input_id in app.extensions['epdf']['results'] for input_id in inputs)
+
+
+def test_async_form_merge(client, app, pdfs):
+    response = client.post('/merge?async=1', data={'files[]': [upload(pdfs[0], '文件.pdf'), upload(pdfs[1], 'b.pdf')]},
+                           content_type='multipart/form-data')
+    assert response.status_code == 202
+    status = wait(client, response.get_json()['jobs'][0]['statusUrl'])
+    assert status['status'] == 'done', status['error']
+    # The uploads were stored only for this job
+    assert len(app.extensions['epdf']['results']) == 1
+
+
+def test_async_form_split(client, app, make_pdf):
+    response = client.post('/split_pdf?async=1', data={'pdf_file': upload(make_pdf([['a'], ['b'], ['c']]), 'doc.pdf'),
+                                                       'mode': 'each'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 202
+    status = wait(client, response.get_json()['jobs'][0]['statusUrl'])
+    assert status['status'] == 'done', status['error']
+    assert len(status['result']['parts']) == 3
+    assert client.get(status['resultUrl']).status_code == 200
+
+
+def test_async_form_merge_rejects_non_pdf_before_storing(client, app, pdfs):
+    response = client.post('/merge?async=1', data={'files[]': [upload(pdfs[0], 'a.pdf'), upload(b'text', 'notes.txt')]},
+                           content_type='multipart/form-data')
+    assert response.status_code == 302
+    assert len(app.extensions['epdf']['results']) == 0
+
+
+def test_upload_rejects_non_pdf(client):
+    response = client.post('/api/uploads', data={'files[]': [upload(b'text', 'notes.txt')]},
+                           content_type='multipart/form-data')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('spec', [
+    {'type': 'merge'},
+    {'type': 'merge', 'inputs': ['UPLOAD']},
+    {'type': 'merge', 'inputs': ['UPLOAD', 'missing']},
+    {'type': 'split', 'input': 'UPLOAD', 'mode': 'halves'},
+    {'type': 'split', 'input': 'UPLOAD', 'mode': 'every', 'every_n': 0},
+    {'type': 'split', 'input': 'UPLOAD', 'mode': 'ranges', 'page_ranges': 'a-b'},
+    {'type': 'rotate', 'input': 'UPLOAD'},
+])
+def test_invalid_job_specs(client, pdfs, spec):
+    upload_id = client.post('/api/uploads', data={'files[]': [upload(pdfs[0], 'a.pdf')]},
+                            content_type='multipart/form-data').get_json()['uploads'][0]['id']
+    for key, value in spec.items():
+        if value == 'UPLOAD':
+            spec[key] = upload_id
+        elif isinstance(value, list):
+            spec[key] = [upload_id if v == 'UPLOAD' else v for v in value]
+    response = client.post('/api/jobs', json=spec)
+    assert response.status_code == 400
+    assert response.get_json()['error']
+
+
+def test_full_queue(tmp_path, pdfs):
+    app = create_app({'TESTING': True, 'RESULT_STORE_DIR': str(tmp_path), 'JOB_QUEUE_DEPTH': 0})
+    client = app.test_client()
+    inputs = [u['id'] for u in client.post('/api/uploads', data={'files[]': [upload(pdf, 'a.pdf') for pdf in pdfs]},
+                                           content_type='multipart/form-data').get_json()['uploads']]
+
+    response = client.post('/api/jobs', json={'type': 'merge', 'inputs': inputs})
+    assert response.status_code == 429
+    assert response.headers['Retry-After']
+
+    response = client.post('/merge?async=1', data={'files[]': [upload(pdf, 'a.pdf') for pdf in pdfs]},
+                           content_type='multipart/form-data')
+    assert response.status_code == 429
+    # Only the /api/uploads inputs are left; the form's uploads were dropped with the job
+    assert len(app.extensions['epdf']['results']) == 2
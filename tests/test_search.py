@@ -0,0 +1,136 @@
+import os
+import pickle
+from io import BytesIO
+
+import pytest
+
+from search import SearchIndex, decode_segment, encode_segment, tokenize
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SearchIndex(directory=str(tmp_path))
+
+
+def doc_ids(results):
+    return [(hit['docId'], hit['page']) for hit in results]
+
+
+def test_add_and_search(index):
+    index.add('a', 'a.pdf', ['the quick brown fox', 'lazy dog'])
+    index.add('b', 'b.pdf', ['quick quick fox'])
+
+    assert doc_ids(index.search('fox')) == [('a', 1), ('b', 1)]
+    assert doc_ids(index.search('quick fox')) == [('b', 1), ('a', 1)]
+    assert doc_ids(index.search('FOX dog')) == []
+    assert index.search('dog')[0]['snippet'] == 'lazy dog'
+    assert index.search('') == []
+
+
+def test_adding_again_replaces(index):
+    index.add('a', 'a.pdf', ['old words'])
+    index.add('a', 'a.pdf', ['new words'])
+    assert len(index) == 1
+    assert index.search('old') == []
+    assert doc_ids(index.search('new')) == [('a', 1)]
+
+
+def test_remove_and_compact(index, tmp_path):
+    for i in range(8):
+        index.add(f'doc{i}', f'{i}.pdf', [f'shared unique{i}'])
+
+    index.remove('doc0')
+    index.remove('doc1')
+    assert index._removed == {0, 1}
+    assert 'doc0' not in index
+    assert len(index.search('shared')) == 6
+    assert index.search('unique0') == []
+    assert len(os.listdir(tmp_path)) == 6
+
+    # A third of the documents are now removed, over the compaction threshold
+    index.remove('doc2')
+    assert not index._removed
+    assert 'unique2' not in index._postings
+    assert [number for number, _, _ in index._iter_postings(index._postings['shared'])] == [3, 4, 5, 6, 7]
+
+
+def test_max_docs_drops_oldest(tmp_path):
+    index = SearchIndex(max_docs=2)
+    for doc_id in 'abc':
+        index.add(doc_id, f'{doc_id}.pdf', ['text'])
+    assert 'a' not in index
+    assert [hit['docId'] for hit in index.search('text')] == ['b', 'c']
+
+
+def test_reload_from_directory(tmp_path):
+    index = SearchIndex(directory=str(tmp_path))
+    index.add('a', 'a.pdf', ['alpha beta', 'gamma'])
+    index.add('b', 'b.pdf', ['beta'])
+    index.remove('b')
+
+    reloaded = SearchIndex(directory=str(tmp_path))
+    assert len(reloaded) == 1
+    assert reloaded.search('gamma') == index.search('gamma')
+    assert reloaded.search('beta') == index.search('beta')
+    reloaded.add('c', 'c.pdf', ['beta'])
+    assert doc_ids(reloaded.search('beta')) == [('a', 1), ('c', 1)]
+
+
+def test_bad_segments_are_skipped(tmp_path):
+    SearchIndex(directory=str(tmp_path)).add('a', 'a.pdf', ['kept'])
+    (tmp_path / '00000007.seg').write_bytes(pickle.dumps({'id': 'evil'}))
+    (tmp_path / '00000008.seg').write_bytes(b'EPDFSEG1 truncated')
+
+    index = SearchIndex(directory=str(tmp_path))
+    assert len(index) == 1
+    assert doc_ids(index.search('kept')) == [('a', 1)]
+
+
+def test_segment_round_trip():
+    segment = {
+        'id': 'a',
+        'filename': 'a.pdf',
+        'pages': 1,
+        'postings': SearchIndex._page_postings(['one two one']),
+        'texts': [b'compressed'],
+    }
+    assert decode_segment(encode_segment(segment)) == segment
+    with pytest.raises(ValueError):
+        decode_segment(encode_segment(segment)[:-1])
+
+
+def test_snippet_positions_survive_case_folding(index):
+    # 'İ'.lower() is two characters, so lowercasing the whole page would shift positions
+    text = 'İİİİ ' * 40 + 'needle'
+    assert len(tokenize(text)) == 41
+    index.add('a', 'a.pdf', [text])
+    assert index.search('needle')[0]['snippet'].endswith('needle')
+
+
+def read_pdf(client, data):
+    response = client.post('/read', data={'file': (BytesIO(data), 'doc.pdf')}, content_type='multipart/form-data')
+    assert response.status_code == 200
+
+
+def test_expired_results_leave_the_index(client, app, make_pdf):
+    read_pdf(client, make_pdf([['needle', 'in'], ['a', 'haystack']]))
+    hits = client.get('/search?q=needle').get_json()['hits']
+    assert len(hits) == 1 and hits[0]['url'].endswith('#page=1')
+
+    results = app.extensions['epdf']['results']
+    results._entries[hits[0]['docId']].last_access -= results.ttl + 1
+    assert client.get('/search?q=needle').get_json()['hits'] == []
+    assert len(app.extensions['epdf']['index']) == 0
+
+
+def test_documents_without_results_are_dropped_from_search(client, app, make_pdf):
+    read_pdf(client, make_pdf([['needle', 'kept']]))
+    index = app.extensions['epdf']['index']
+    # As if indexed by an earlier process whose results are gone
+    for i in range(3):
+        index.add(f'gone{i}', 'old.pdf', ['needle ' * (5 - i)])
+
+    hits = client.get('/search?q=needle&limit=2').get_json()['hits']
+    assert [hit['filename'] for hit in hits] == ['doc.pdf']
+    assert all('url' in hit for hit in hits)
+    assert len(index) == 1
@@ -0,0 +1,85 @@
+import re
+import zipfile
+from io import BytesIO
+
+import pytest
+
+from funcs import parse_page_ranges, every_n_pages, split_ranges, stream_zip
+from store import ResultStore
+
+
+def test_overlapping_ranges_are_kept():
+    assert parse_page_ranges('1-3, 2-5, 7', 10) == [(1, 3), (2, 5), (7, 7)]
+
+
+def test_range_end_is_clamped():
+    assert parse_page_ranges('8-20', 10) == [(8, 10)]
+
+
+@pytest.mark.parametrize('spec', ['0-2', '3-1', '11', '11-12', 'a', '1-b', '1-2-3', '', ' , '])
+def test_invalid_ranges(spec):
+    with pytest.raises(ValueError):
+        parse_page_ranges(spec, 10)
+
+
+def test_every_n_pages():
+    assert every_n_pages(7, 3) == [(1, 3), (4, 6), (7, 7)]
+    assert every_n_pages(2, 5) == [(1, 2)]
+    with pytest.raises(ValueError):
+        every_n_pages(7, 0)
+
+
+def test_split_modes():
+    assert split_ranges(3, 'each') == [(1, 1), (2, 2), (3, 3)]
+    assert split_ranges(5, 'every', every_n='2') == [(1, 2), (3, 4), (5, 5)]
+    assert split_ranges(5, 'ranges', page_ranges='2-3') == [(2, 3)]
+    with pytest.raises(ValueError):
+        split_ranges(5, 'halves')
+
+
+def test_stream_zip_round_trip(tmp_path):
+    store = ResultStore(spill_threshold=1000, spill_dir=str(tmp_path))
+    contents = {
+        'split_1_doc.pdf': b'%PDF-1.7 first part',
+        'split_2_doc.pdf': b'%PDF-1.7 ' + bytes(range(256)) * 10,
+    }
+    ids = [store.put(data, filename) for filename, data in contents.items()]
+    assert not store.get(ids[1]).in_memory
+
+    archive = b''.join(stream_zip(store.get_parts(store.put_group(ids)), chunk_size=64))
+    with zipfile.ZipFile(BytesIO(archive)) as z:
+        assert z.testzip() is None
+        assert z.namelist() == list(contents)
+        for filename, data in contents.items():
+            assert z.getinfo(filename).compress_type == zipfile.ZIP_STORED
+            assert z.read(filename) == data
+
+
+def post_split(client, data, filename='doc.pdf', **form):
+    form['pdf_file'] = (BytesIO(data), filename)
+    return client.post('/split_pdf', data=form, content_type='multipart/form-data', follow_redirects=True)
+
+
+def test_split_route(client, make_pdf):
+    response = post_split(client, make_pdf([['one'], ['two'], ['three']]), mode='every', every_n='2')
+    assert response.status_code == 200
+    job_ids = re.findall(r'/pdf/([0-9a-f]{32})', response.get_data(as_text=True))
+    assert len(set(job_ids)) == 2
+
+
+@pytest.mark.parametrize('form, message', [
+    ({'mode': 'ranges', 'page_ranges': '3-1'}, 'Invalid page range'),
+    ({'mode': 'every', 'every_n': 'two'}, 'Pages per file must be a whole number of at least 1'),
+    ({'mode': 'every', 'every_n': '0'}, 'Pages per file must be a whole number of at least 1'),
+])
+def test_split_route_rejects_bad_input(client, make_pdf, form, message):
+    response = post_split(client, make_pdf([['one'], ['two']]), **form)
+    assert response.status_code == 200
+    assert message in response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize('data', [b'%PDF-1.7 but nothing else', b''])
+def test_split_route_rejects_unreadable_pdf(client, data):
+    response = post_split(client, data, filename='broken.pdf', mode='each')
+    assert response.status_code == 200
+    assert 'broken.pdf could not be read as a PDF file' in response.get_data(as_text=True)
@@ -0,0 +1,33 @@
+from funcs import get_pdf_info, merge_pdfs
+from store import ResultStore
+
+
+def page_words(counts):
+    return [[f'word{page}x{i}' for i in range(count)] for page, count in enumerate(counts)]
+
+
+def test_pdf_info_counts_each_page_once(make_pdf):
+    counts = [3, 0, 7, 1, 12]
+    info = get_pdf_info(make_pdf(page_words(counts)), keep_text=True)
+    assert info['numPages'] == 5
+    assert info['pageWords'] == counts
+    assert info['numWords'] == sum(info['pageWords']) == 23
+    assert info['pageText'][2].split() == page_words(counts)[2]
+
+
+def test_merge_counts_each_page_once(make_pdf, tmp_path):
+    store = ResultStore(spill_dir=str(tmp_path))
+    first, second = [5, 2, 9], [4, 4]
+    inputs = [store.get(store.put(make_pdf(page_words(counts)), f'{name}.pdf'))
+              for name, counts in (('first', first), ('second', second))]
+
+    with store.writer('output.pdf') as output:
+        result = merge_pdfs(inputs, output)
+    assert result['numPages'] == 5
+    assert result['numWords'] == sum(first) + sum(second)
+    assert [f['pageWords'] for f in result['files']] == [first, second]
+    assert [f['numWords'] for f in result['files']] == [sum(first), sum(second)]
+
+    merged = get_pdf_info(store.get(output.job_id).source)
+    assert merged['pageWords'] == first + second
+    assert merged['numWords'] == result['numWords']
@@ -0,0 +1,176 @@
+import os
+import sys
+import hashlib
+import subprocess
+
+from store import ResultStore
+
+
+def make_store(tmp_path, **kwargs):
+    return ResultStore(spill_dir=str(tmp_path / 'spill'), **kwargs)
+
+
+def test_put_keeps_bytes_and_copies_other_buffers(tmp_path):
+    store = make_store(tmp_path)
+    data = b'%PDF-1.7 bytes'
+    assert store.get(store.put(data)).data is data
+
+    buffer = bytearray(b'%PDF-1.7 bytearray')
+    entry = store.get(store.put(memoryview(buffer)))
+    buffer[:] = b'x' * len(buffer)
+    assert entry.data == b'%PDF-1.7 bytearray'
+    assert store.memory_used == len(data) + len(buffer)
+
+
+def test_put_over_spill_threshold_goes_to_disk(tmp_path):
+    store = make_store(tmp_path, spill_threshold=10)
+    entry = store.get(store.put(b'a' * 11))
+    assert not entry.in_memory
+    assert store.memory_used == 0
+    with entry.open() as f:
+        assert f.read() == b'a' * 11
+
+
+def test_budget_spills_least_recently_used(tmp_path):
+    store = make_store(tmp_path, max_memory=250)
+    first = store.put(b'1' * 100)
+    second = store.put(b'2' * 100)
+    store.get(first)
+    third = store.put(b'3' * 100)
+
+    assert store.memory_used == 200
+    assert not store.get(second).in_memory
+    assert store.get(first).in_memory and store.get(third).in_memory
+    with store.get(second).open() as f:
+        assert f.read() == b'2' * 100
+
+
+def test_ttl_expires_unused_results(tmp_path):
+    store = make_store(tmp_path, ttl=60, spill_threshold=10)
+    stale = store.put(b'stale')
+    spilled = store.put(b's' * 20)
+    fresh = store.put(b'fresh')
+    spill_path = store.get(spilled).path
+    store.get(fresh)
+    for job_id in (stale, spilled):
+        store._entries[job_id].last_access -= 120
+
+    assert store.get(stale) is None
+    assert spilled not in store
+    assert not os.path.exists(spill_path)
+    assert store.get(fresh).data == b'fresh'
+    assert store.memory_used == len(b'fresh')
+
+
+def test_put_file_hard_links_large_files(tmp_path):
+    store = make_store(tmp_path, spill_threshold=10)
+    source = tmp_path / 'big.pdf'
+    source.write_bytes(b'b' * 100)
+
+    entry = store.get(store.put_file(str(source)))
+    assert not entry.in_memory
+    assert entry.size == 100
+    assert os.stat(entry.path).st_ino == os.stat(source).st_ino
+
+    # The stored copy outlives the original
+    source.unlink()
+    with entry.open() as f:
+        assert f.read() == b'b' * 100
+
+
+def test_put_file_reads_small_files(tmp_path):
+    store = make_store(tmp_path, spill_threshold=10)
+    source = tmp_path / 'small.pdf'
+    source.write_bytes(b'small')
+    entry = store.get(store.put_file(str(source)))
+    assert entry.data == b'small'
+
+
+def test_writer_discards_on_error(tmp_path):
+    store = make_store(tmp_path)
+    try:
+        with store.writer(job_id='broken') as out:
+            out.write(b'partial')
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert 'broken' not in store
+    assert len(store) == 0
+
+
+def test_groups_skip_missing_parts(tmp_path):
+    store = make_store(tmp_path)
+    parts = [store.put(b'one'), store.put(b'two')]
+    group = store.put_group(parts)
+    store.delete(parts[0])
+    assert [part.data for part in store.get_parts(group)] == [b'two']
+    assert store.get_parts(parts[1]) is None
+
+
+def test_stale_spill_files_are_swept_on_first_use(tmp_path):
+    spill_dir = tmp_path / 'spill'
+    spill_dir.mkdir()
+    (spill_dir / 'left-by-a-crash.bin').write_bytes(b'stale')
+    (spill_dir / 'unrelated.txt').write_bytes(b'kept')
+
+    store = make_store(tmp_path, spill_threshold=1)
+    assert (spill_dir / 'left-by-a-crash.bin').exists()
+    job_id = store.put(b'new')
+    assert sorted(os.listdir(spill_dir)) == ['.lock', f'{job_id}.bin', 'unrelated.txt']
+
+    # Another store of the same process shares the directory without sweeping it
+    other = make_store(tmp_path)
+    assert other.get('unknown') is None
+    assert store.get(job_id).open().read() == b'new'
+
+
+def test_spill_dir_is_single_process(tmp_path):
+    store = make_store(tmp_path)
+    store.put(b'claimed')
+    child = subprocess.run(
+        [sys.executable, '-c', 'import sys; from store import ResultStore; '
+                               'ResultStore(spill_dir=sys.argv[1]).get("x")', str(tmp_path / 'spill')],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True, text=True)
+    assert child.returncode != 0
+    assert 'in use by another process' in child.stderr
+
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def test_etags_are_computed_as_results_are_stored(tmp_path):
+    store = make_store(tmp_path, spill_threshold=100)
+    small, large = b'small result', b'L' * 150
+    for data in (small, bytearray(large)):
+        entry = store.get(store.put(data))
+        assert entry._etag == content_hash(bytes(data))
+
+    for chunks in ([small], [large[:60], large[60:120], large[120:]]):
+        with store.writer() as out:
+            for chunk in chunks:
+                out.write(chunk)
+        entry = store.get(out.job_id)
+        assert entry._etag == content_hash(b''.join(chunks))
+
+
+def test_etag_after_rewriting_the_start(tmp_path):
+    # A linearized save goes back and rewrites the header once the body is written
+    store = make_store(tmp_path, spill_threshold=100)
+    for size in (50, 150):
+        with store.writer() as out:
+            out.write(b'-' * 10 + b'b' * (size - 10))
+            out.seek(0)
+            out.write(b'header    ')
+            out.seek(0, os.SEEK_END)
+        entry = store.get(out.job_id)
+        assert entry._etag == content_hash(b'header    ' + b'b' * (size - 10))
+
+
+def test_put_file_etag_is_read_on_first_use(tmp_path):
+    store = make_store(tmp_path, spill_threshold=10)
+    source = tmp_path / 'big.pdf'
+    source.write_bytes(b'b' * 100)
+    entry = store.get(store.put_file(str(source)))
+    assert entry._etag is None
+    assert entry.etag == content_hash(b'b' * 100)
@@ -0,0 +1,15 @@
+from io import BytesIO
+
+
+def test_thumbnail_etag_does_not_hash_the_document(client, app, make_pdf, monkeypatch):
+    job_id = app.extensions['epdf']['results'].put(BytesIO(make_pdf([['one'], ['two']])))
+    monkeypatch.setattr('store.StoredResult.etag', property(lambda self: 1 / 0))
+
+    response = client.get(f'/thumb/{job_id}/2?dpi=40&fmt=png')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert response.headers['ETag'] == f'"{job_id}-2-40-png"'
+
+    cached = client.get(f'/thumb/{job_id}/2?dpi=40&fmt=png', headers={'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+    assert client.get(f'/thumb/{job_id}/3').status_code == 404
@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+
+from funcs import open_pdf
+
+"""
+THUMBNAILS: PAGES RENDERED ON DEMAND WITH FITZ AND KEPT IN A SIZE-BOUNDED LRU CACHE
+"""
+
+DEFAULT_THUMB_CACHE_SIZE = 32 * 1024 * 1024
+DEFAULT_THUMB_DPI = 48
+MIN_THUMB_DPI = 12
+MAX_THUMB_DPI = 150
+
+# fitz can encode these without extra dependencies
+FORMATS = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+}
+
+
+def render_page(pdf, page, dpi=DEFAULT_THUMB_DPI, fmt='png'):
+    """
+    Render a 1-based page of an open fitz document to image bytes
+    """
+    pix = pdf[page - 1].get_pixmap(dpi=dpi, alpha=False)
+    return pix.tobytes(fmt)
+
+
+class ThumbnailCache:
+    """
+    Thread-safe LRU of rendered pages keyed by (job_id, page, dpi, fmt),
+    holding at most `max_bytes` of image data
+    """
+    def __init__(self, max_bytes=DEFAULT_THUMB_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def thumbnail(self, result, page, dpi=DEFAULT_THUMB_DPI, fmt='png'):
+        """
+        Image bytes for a page of a stored result, rendered on a cache miss.
+        Raises IndexError for a page outside the document.
+        """
+        key = (result.job_id, page, dpi, fmt)
+        data = self.get(key)
+        if data is None:
+            with open_pdf(result.source) as pdf:
+                if not 1 <= page <= pdf.page_count:
+                    raise IndexError(f'Page {page} is outside 1-{pdf.page_count}')
+                data = render_page(pdf, page, dpi, fmt)
+            self.put(key, data)
+        return data
+
+    def prerender(self, result, pages, dpi=DEFAULT_THUMB_DPI, fmt='png'):
+        """
+        Render the first `pages` pages of a stored result in one pass over the document
+        """
+        with open_pdf(result.source) as pdf:
+            count = min(pages, pdf.page_count)
+            for page in range(1, count + 1):
+                key = (result.job_id, page, dpi, fmt)
+                if self.get(key) is None:
+                    self.put(key, render_page(pdf, page, dpi, fmt))
+        return count
+
+
+def prerender_job(job, cache, store, job_ids, pages, dpi=DEFAULT_THUMB_DPI, fmt='png'):
+    """
+    Background job: pre-render the first pages of several stored results
+    """
+    rendered = 0
+    for job_id in job_ids:
+        result = store.get(job_id)
+        if result is not None:
+            rendered += cache.prerender(result, pages, dpi, fmt)
+        job.progress(rendered, None)
+    job.progress(rendered, rendered)
+    return {'rendered': rendered}
@@ -0,0 +1,121 @@
+import tempfile
+from io import BytesIO
+from contextlib import contextmanager
+from flask import Request
+from store import StoredResult
+from metrics import span
+
+"""
+UPLOAD SPOOLING: UPLOADS ARE WRITTEN IN CHUNKS TO RAM, OR TO A NAMED TEMP FILE
+ONCE THEY GROW PAST A THRESHOLD, SO FITZ CAN OPEN THEM BY PATH WITHOUT A COPY
+"""
+
+DEFAULT_SPOOL_THRESHOLD = 4 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+
+class SpooledUpload:
+    """
+    Writable/readable file object that starts as a BytesIO and rolls over to a
+    named temporary file (deleted on close) past `max_size` bytes
+    """
+    def __init__(self, max_size=DEFAULT_SPOOL_THRESHOLD, dir=None):
+        self.max_size = max_size
+        self.dir = dir
+        self._file = BytesIO()
+        self.path = None
+
+    @property
+    def rolled_over(self):
+        return self.path is not None
+
+    def rollover(self):
+        if self.rolled_over:
+            return
+        disk_file = tempfile.NamedTemporaryFile(prefix='epdf-upload-', suffix='.pdf', dir=self.dir)
+        disk_file.write(self._file.getbuffer())
+        disk_file.seek(self._file.tell())
+        self._file.close()
+        self._file = disk_file
+        self.path = disk_file.name
+
+    def write(self, data):
+        written = self._file.write(data)
+        if not self.rolled_over and self._file.tell() > self.max_size:
+            self.rollover()
+        return written
+
+    def source(self):
+        """
+        The upload without reading it into a new buffer: the temp file path,
+        or a memoryview of the bytes while it is still in RAM. The view must
+        be released before the upload is closed (spooled_source does this).
+        """
+        if self.rolled_over:
+            self._file.flush()
+            return self.path
+        return self._file.getbuffer()
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush/close/... go to the current underlying file
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+
+
+class SpoolingRequest(Request):
+    """
+    Flask request class whose multipart uploads are parsed into SpooledUploads
+    """
+    spool_threshold = DEFAULT_SPOOL_THRESHOLD
+    spool_dir = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledUpload(self.spool_threshold, self.spool_dir)
+
+    def _load_form_data(self):
+        if 'form' in self.__dict__:
+            return
+        # Receiving and spooling the request body, timed as its own phase
+        with span('upload.parse', bytes_in=self.content_length or 0):
+            super()._load_form_data()
+
+
+@contextmanager
+def spooled_source(file_storage, threshold=DEFAULT_SPOOL_THRESHOLD):
+    """
+    Yield an uploaded file as a path or bytes-like object for open_pdf. Uploads parsed by
+    SpoolingRequest and results already in the store are used in place;
+    anything else is copied in chunks into a SpooledUpload first.
+    """
+    if isinstance(file_storage, StoredResult):
+        yield file_storage.source
+        return
+
+    stream = getattr(file_storage, 'stream', file_storage)
+    if isinstance(stream, SpooledUpload):
+        with _released(stream.source()) as source:
+            yield source
+        return
+
+    with SpooledUpload(threshold) as spool:
+        stream.seek(0)
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            spool.write(chunk)
+        with _released(spool.source()) as source:
+            yield source
+
+
+@contextmanager
+def _released(source):
+    # A BytesIO can't be closed while a memoryview of it is alive
+    try:
+        yield source
+    finally:
+        if isinstance(source, memoryview):
+            source.release()
+